@@ -0,0 +1,457 @@
+"""
+Benchmarks of the mesh processing and network kernels.
+
+usage:
+    python benchmark.py qslim [-t template.obj]
+    python benchmark.py procrustes [-t template.obj] [-b batch_size]
+    python benchmark.py spmm [-c config.cfg] [-b batch sizes]
+    python benchmark.py chebyshev [-c config.cfg] [-k scatter|spmm]
+    python benchmark.py layout [-c config.cfg] [-k scatter|spmm]
+    python benchmark.py recompute [-c config.cfg] [-k scatter|spmm]
+    python benchmark.py reorder [-c config.cfg] [-k scatter|spmm]
+    python benchmark.py attention [-c config.cfg] [-b batch_size]
+    python benchmark.py compile [-c config.cfg] [-B compile|script]
+"""
+import argparse
+from config_parser import read_config
+import heapq
+import hierarchy_cache
+import math
+import mesh_operations
+import model as model_module
+from nn.conv import ChebConv_batch, graph_attention, sparse_graph_attention
+from nn.pool import SurfacePool
+from nn.sparse import SparseOperator
+import numpy as np
+import reorder
+import os
+import scipy.sparse as sp
+from psbody.mesh import Mesh
+import time
+from topology import get_mesh_topology
+import torch
+import utils
+
+def timeit(function, repeat=1):
+    best = None
+    for i in range(repeat):
+        begin = time.time()
+        result = function()
+        duration = time.time() - begin
+        if best is None or duration < best: best = duration
+    return result, best
+
+def qslim_decimator_transformer_legacy(mesh, factor=None, n_verts_desired=None):
+    """Return a simplified version of this mesh.
+
+    A Qslim-style approach is used here. Original implementation of
+    mesh_operations.qslim_decimator_transformer, kept as reference: it
+    rescans the whole queue and face list after each collapse.
+
+    :param factor: fraction of the original vertices to retain
+    :param n_verts_desired: number of the original vertices to retain
+    :returns: new_faces: An Fx3 array of faces, mtx: Transformation matrix
+    """
+
+    if factor is None and n_verts_desired is None:
+        raise Exception('Need either factor or n_verts_desired.')
+
+    if n_verts_desired is None:
+        n_verts_desired = math.ceil(len(mesh.v) * factor)
+
+    Qv = mesh_operations.vertex_quadrics(mesh)
+
+    # fill out a sparse matrix indicating vertex-vertex adjacency
+    # from psbody.mesh.topology.connectivity import get_vertices_per_edge
+    vert_adj = mesh_operations.get_vertices_per_edge(mesh.v, mesh.f)
+    # vert_adj = sp.lil_matrix((len(mesh.v), len(mesh.v)))
+    # for f_idx in range(len(mesh.f)):
+    #     vert_adj[mesh.f[f_idx], mesh.f[f_idx]] = 1
+
+    vert_adj = sp.csc_matrix((vert_adj[:, 0] * 0 + 1, (vert_adj[:, 0], vert_adj[:, 1])), shape=(len(mesh.v), len(mesh.v)))
+    vert_adj = vert_adj + vert_adj.T
+    vert_adj = vert_adj.tocoo()
+
+    def collapse_cost(Qv, r, c, v):
+        Qsum = Qv[r, :, :] + Qv[c, :, :]
+        p1 = np.vstack((v[r].reshape(-1, 1), np.array([1]).reshape(-1, 1)))
+        p2 = np.vstack((v[c].reshape(-1, 1), np.array([1]).reshape(-1, 1)))
+
+        destroy_c_cost = p1.T.dot(Qsum).dot(p1)
+        destroy_r_cost = p2.T.dot(Qsum).dot(p2)
+        result = {
+            'destroy_c_cost': destroy_c_cost,
+            'destroy_r_cost': destroy_r_cost,
+            'collapse_cost': min([destroy_c_cost, destroy_r_cost]),
+            'Qsum': Qsum}
+        return result
+
+    # construct a queue of edges with costs
+    queue = []
+    for k in range(vert_adj.nnz):
+        r = vert_adj.row[k]
+        c = vert_adj.col[k]
+
+        if r > c:
+            continue
+
+        cost = collapse_cost(Qv, r, c, mesh.v)['collapse_cost']
+        heapq.heappush(queue, (cost, (r, c)))
+
+    # decimate
+    collapse_list = []
+    nverts_total = len(mesh.v)
+    faces = mesh.f.copy()
+    while nverts_total > n_verts_desired:
+        e = heapq.heappop(queue)
+        r = e[1][0]
+        c = e[1][1]
+        if r == c:
+            continue
+
+        cost = collapse_cost(Qv, r, c, mesh.v)
+        if cost['collapse_cost'] > e[0]:
+            heapq.heappush(queue, (cost['collapse_cost'], e[1]))
+            # print 'found outdated cost, %.2f < %.2f' % (e[0], cost['collapse_cost'])
+            continue
+        else:
+
+            # update old vert idxs to new one,
+            # in queue and in face list
+            if cost['destroy_c_cost'] < cost['destroy_r_cost']:
+                to_destroy = c
+                to_keep = r
+            else:
+                to_destroy = r
+                to_keep = c
+
+            collapse_list.append([to_keep, to_destroy])
+
+            # in our face array, replace "to_destroy" vertidx with "to_keep" vertidx
+            np.place(faces, faces == to_destroy, to_keep)
+
+            # same for queue
+            which1 = [idx for idx in range(len(queue)) if queue[idx][1][0] == to_destroy]
+            which2 = [idx for idx in range(len(queue)) if queue[idx][1][1] == to_destroy]
+            for k in which1:
+                queue[k] = (queue[k][0], (to_keep, queue[k][1][1]))
+            for k in which2:
+                queue[k] = (queue[k][0], (queue[k][1][0], to_keep))
+
+            Qv[r, :, :] = cost['Qsum']
+            Qv[c, :, :] = cost['Qsum']
+
+            a = faces[:, 0] == faces[:, 1]
+            b = faces[:, 1] == faces[:, 2]
+            c = faces[:, 2] == faces[:, 0]
+
+            # remove degenerate faces
+            def logical_or3(x, y, z):
+                return np.logical_or(x, np.logical_or(y, z))
+
+            faces_to_keep = np.logical_not(logical_or3(a, b, c))
+            faces = faces[faces_to_keep, :].copy()
+
+        nverts_total = (len(np.unique(faces.flatten())))
+
+    new_faces, mtx = mesh_operations._get_sparse_transform(faces, len(mesh.v))
+    return new_faces, mtx
+
+def qslim(args):
+    mesh = Mesh(filename=args.template)
+    for level, factor in enumerate(args.factors):
+        (f_legacy, D_legacy), t_legacy = timeit(lambda: qslim_decimator_transformer_legacy(mesh, factor=1.0 / factor))
+        (f_new, D_new), t_new = timeit(lambda: mesh_operations.qslim_decimator_transformer(mesh, factor=1.0 / factor))
+        same = (D_legacy != D_new).nnz == 0 and np.array_equal(f_legacy, f_new)
+        print('level {}: {} -> {} vertices, legacy {:.3f}s, indexed queue {:.3f}s, speedup x{:.1f}, identical D: {}'.format(
+            level + 1, len(mesh.v), D_new.shape[0], t_legacy, t_new, t_legacy / t_new, same))
+        mesh = Mesh(v=D_new.dot(mesh.v), f=f_new)
+
+def procrustes(args):
+    template = Mesh(filename=args.template).v
+    rng = np.random.default_rng(0)
+    rotations = np.linalg.qr(rng.normal(size=(args.batch_size, 3, 3)))[0]
+    meshes = (template + rng.normal(scale=0.01, size=(args.batch_size,) + template.shape)) @ rotations
+    meshes = meshes * rng.uniform(0.5, 2, size=(args.batch_size, 1, 1)) + rng.normal(size=(args.batch_size, 1, 3))
+
+    loop, t_loop = timeit(lambda: [utils.procrustes(template, mesh) for mesh in meshes], args.repeat)
+    (_, aligned, _, (R, s, m)), t_batch = timeit(lambda: utils.procrustes_batch(template, meshes), args.repeat)
+    error = max(np.abs(aligned[i] - loop[i][1]).max() for i in range(args.batch_size))
+    print('{} meshes of {} vertices: loop {:.3f}s, batched numpy {:.3f}s, speedup x{:.1f}, max difference {:.2e}'.format(
+        args.batch_size, len(template), t_loop, t_batch, t_loop / t_batch, error))
+
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        tensor = torch.tensor(meshes, device=device)
+        def run():
+            result = utils.procrustes_batch(template, tensor)
+            if device == 'cuda': torch.cuda.synchronize()
+            return result
+        (_, aligned_t, _, _), t_torch = timeit(run, args.repeat)
+        error = np.abs(aligned_t.cpu().numpy() - aligned).max()
+        print('batched torch on {}: {:.3f}s, speedup x{:.1f}, max difference {:.2e}'.format(device, t_torch, t_loop / t_torch, error))
+
+def forward_backward(function, x, device):
+    """Runs function(x) and its backward pass, returns the output and the
+    gradients of x and of the parameters of the layers."""
+    def run():
+        x.grad = None
+        out = function(x)
+        out.backward(torch.ones_like(out))
+        if device == 'cuda': torch.cuda.synchronize()
+        return out.detach(), x.grad.clone()
+    return run
+
+def spmm(args):
+    config = read_config(args.conf)
+    if args.cache_dir: config['cache_dir'] = args.cache_dir
+    template = Mesh(filename=config['template'])
+    M, A, D, U = hierarchy_cache.generate_transform_matrices(config, template)
+    device = args.device
+    pool = SurfacePool()
+    torch.manual_seed(0)
+
+    for level in range(min(args.levels, len(M))):
+        num_nodes = len(M[level].v)
+        edge_index, norm = [t.to(device) for t in get_mesh_topology(M[level]).cheb_norm]
+        laplacian = SparseOperator.from_messages(edge_index, norm, num_nodes)
+        conv = ChebConv_batch(args.features, args.features, args.K).to(device)
+        down = D[level].tocoo()
+        down_coo = torch.sparse_coo_tensor(np.vstack((down.row, down.col)), down.data, down.shape, dtype=torch.float32).coalesce().to(device)
+        down_operator = SparseOperator.from_coo(down_coo)
+
+        for batch_size in args.batch_sizes:
+            x = torch.randn(batch_size, num_nodes, args.features, device=device, requires_grad=True)
+            results = {}
+            for name, conv_function, pool_function in [
+                    ('scatter', lambda x: conv(x, edge_index, norm), lambda x: pool(x, down_coo)),
+                    ('spmm', lambda x: conv(x, edge_index, norm, operator=laplacian), lambda x: pool(x, down_operator))]:
+                results[name] = [timeit(forward_backward(conv_function, x, device), args.repeat),
+                                 timeit(forward_backward(pool_function, x, device), args.repeat)]
+
+            for i, layer in enumerate(['ChebConv K={}'.format(args.K), 'SurfacePool']):
+                (out_s, grad_s), t_s = results['scatter'][i]
+                (out_m, grad_m), t_m = results['spmm'][i]
+                error = max((out_s - out_m).abs().max().item() / out_s.abs().max().item(),
+                            (grad_s - grad_m).abs().max().item() / grad_s.abs().max().item())
+                print('level {} ({} vertices), batch {:3d}, {:14s}: gather/scatter {:.4f}s, spmm {:.4f}s, speedup x{:.1f}, max relative difference {:.1e}'.format(
+                    level, num_nodes, batch_size, layer, t_s, t_m, t_s / t_m, error))
+
+def chebyshev(args):
+    config = read_config(args.conf)
+    if args.cache_dir: config['cache_dir'] = args.cache_dir
+    template = Mesh(filename=config['template'])
+    M, A, D, U = hierarchy_cache.generate_transform_matrices(config, template)
+    device = args.device
+    torch.manual_seed(0)
+
+    for level in range(min(args.levels, len(M))):
+        num_nodes = len(M[level].v)
+        edge_index, norm = [t.to(device) for t in get_mesh_topology(M[level]).cheb_norm]
+        laplacian = SparseOperator.from_messages(edge_index, norm, num_nodes) if args.kernel == 'spmm' else None
+        conv = ChebConv_batch(args.features, args.features, args.K).to(device)
+        fused = ChebConv_batch(args.features, args.features, args.K, fused=True).to(device)
+        fused.load_state_dict(conv.state_dict())
+
+        for batch_size in args.batch_sizes:
+            x = torch.randn(batch_size, num_nodes, args.features, device=device, requires_grad=True)
+            (out, grad), t = timeit(forward_backward(lambda x: conv(x, edge_index, norm, operator=laplacian), x, device), args.repeat)
+            (out_f, grad_f), t_f = timeit(forward_backward(lambda x: fused(x, edge_index, norm, operator=laplacian), x, device), args.repeat)
+            error = max((out - out_f).abs().max().item() / out.abs().max().item(),
+                        (grad - grad_f).abs().max().item() / grad.abs().max().item(),
+                        (conv.weight.grad - fused.weight.grad).abs().max().item() / conv.weight.grad.abs().max().item())
+            conv.zero_grad()
+            fused.zero_grad()
+            print('level {} ({} vertices), batch {:3d}, {} kernel: K matmuls {:.4f}s, fused GEMM {:.4f}s, speedup x{:.2f}, max relative difference {:.1e}'.format(
+                level, num_nodes, batch_size, args.kernel, t, t_f, t / t_f, error))
+
+def model_variants(args, option, values=(False, True)):
+    """Two cheb_VAE with the same weights, with the two values of option."""
+    config = read_config(args.conf)
+    if args.cache_dir: config['cache_dir'] = args.cache_dir
+    config['conv_kernel'] = args.kernel
+    networks = {}
+    for value in values:
+        config[option] = value
+        torch.manual_seed(0)
+        networks[value] = model_module.get_model(config, args.device, model_type='cheb_VAE', save_init=False)[0].eval()
+    return config, networks
+
+def training_step(net, x, y, device):
+    """Forward + backward pass of net, returns the reconstruction, the
+    concatenated parameter gradients and the size in bytes of the tensors
+    saved by autograd for the backward pass."""
+    def run():
+        saved = [0]
+        def pack(tensor):
+            saved[0] += tensor.numel() * tensor.element_size()
+            return tensor
+        net.zero_grad()
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            loss, correct, recon, _, _ = net(x, x, y)
+        loss.backward()
+        if device == 'cuda': torch.cuda.synchronize()
+        return recon.detach(), torch.cat([p.grad.flatten() for p in net.parameters() if p.grad is not None]), saved[0]
+    return run
+
+def compare_models(args, option, values=(False, True)):
+    config, networks = model_variants(args, option, values)
+    num_nodes = networks[values[0]].downsample_matrices[0].shape[1]
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, num_nodes, 3, device=args.device)
+        y = torch.nn.functional.one_hot(torch.arange(batch_size, device=args.device) % config['num_classes'], config['num_classes']).float()
+        (recon, grad, saved), t = timeit(training_step(networks[values[0]], x, y, args.device), args.repeat)
+        (recon_o, grad_o, saved_o), t_o = timeit(training_step(networks[values[1]], x, y, args.device), args.repeat)
+        error = max((recon - recon_o).abs().max().item() / recon.abs().max().item(),
+                    (grad - grad_o).abs().max().item() / grad.abs().max().item())
+        print('batch {:3d}, {} kernel, {}: {} {:.4f}s {:.1f}MB saved, {} {:.4f}s {:.1f}MB saved, speedup x{:.2f}, max relative difference {:.1e}'.format(
+            batch_size, args.kernel, option, values[0], t, saved / 2**20, values[1], t_o, saved_o / 2**20, t / t_o, error))
+
+def layout(args):
+    compare_models(args, 'node_major')
+
+def recompute(args):
+    compare_models(args, 'recompute_chebyshev')
+
+def attention(args):
+    config = read_config(args.conf)
+    if args.cache_dir: config['cache_dir'] = args.cache_dir
+    template = Mesh(filename=config['template'])
+    M, A, D, U = hierarchy_cache.generate_transform_matrices(config, template)
+    device = args.device
+    torch.manual_seed(0)
+    dense_layer = graph_attention(args.heads, args.features, args.features).to(device).eval()
+    sparse_layer = sparse_graph_attention(args.heads, args.features, args.features).to(device).eval()
+    sparse_layer.load_state_dict(dense_layer.state_dict())
+
+    def saved_bytes(run):
+        saved = [0]
+        def pack(tensor):
+            saved[0] += tensor.numel() * tensor.element_size()
+            return tensor
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            result = run()
+        return result, saved[0]
+
+    for level in range(min(args.levels, len(M))):
+        topology = get_mesh_topology(M[level])
+        num_nodes = topology.num_vertices
+        edge_index = topology.edge_index.to(device)
+        x = torch.randn(args.batch_size, num_nodes, args.features, device=device, requires_grad=True)
+        ((out_s, grad_s), t_s), saved_s = saved_bytes(lambda: timeit(forward_backward(lambda x: sparse_layer(x, edge_index), x, device), args.repeat))
+        if num_nodes > args.dense_max:
+            print('level {} ({} vertices), batch {}: sparse {:.4f}s {:.1f}MB saved, dense skipped'.format(
+                level, num_nodes, args.batch_size, t_s, saved_s / 2**20))
+            continue
+        mask = torch.sparse_coo_tensor(edge_index.flip(0), torch.ones(edge_index.size(1)), (num_nodes, num_nodes), device=device).to_dense()
+        ((out_d, grad_d), t_d), saved_d = saved_bytes(lambda: timeit(forward_backward(lambda x: dense_layer(x, mask), x, device), args.repeat))
+        error = max((out_s - out_d).abs().max().item() / out_d.abs().max().item(),
+                    (grad_s - grad_d).abs().max().item() / grad_d.abs().max().item())
+        print('level {} ({} vertices), batch {}: dense {:.4f}s {:.1f}MB saved, sparse {:.4f}s {:.1f}MB saved, speedup x{:.1f}, max relative difference {:.1e}'.format(
+            level, num_nodes, args.batch_size, t_d, saved_d / 2**20, t_s, saved_s / 2**20, t_d / t_s, error))
+
+def compiled(args):
+    config = read_config(args.conf)
+    if args.cache_dir: config['cache_dir'] = args.cache_dir
+    device = args.device
+    torch.manual_seed(0)
+    net = model_module.get_model(config, device, model_type='cheb_VAE', save_init=False)[0].eval()
+    num_nodes = net.downsample_matrices[0].shape[1]
+    x = torch.randn(args.batch_size, num_nodes, 3, device=device)
+    y = torch.nn.functional.one_hot(torch.arange(args.batch_size, device=device) % config['num_classes'], config['num_classes']).float()
+    step = training_step(net, x, y, device)
+    (recon, grad, saved), t = timeit(step, args.repeat)
+    begin = time.time()
+    net.compile_static(args.backend)
+    step()
+    print('compilation and first step: {:.1f}s'.format(time.time() - begin))
+    step()  # second compilation, for the backward pass or the recompiled graphs
+    (recon_c, grad_c, saved), t_c = timeit(step, args.repeat)
+    error = max((recon - recon_c).abs().max().item() / recon.abs().max().item(),
+                (grad - grad_c).abs().max().item() / grad.abs().max().item())
+    print('batch {}, training step: eager {:.4f}s, {} {:.4f}s, speedup x{:.2f}, max relative difference {:.1e}'.format(
+        args.batch_size, t, args.backend, t_c, t / t_c, error))
+
+def vertex_order(args):
+    config = read_config(args.conf)
+    if args.cache_dir: config['cache_dir'] = args.cache_dir
+    M, A, D, U = hierarchy_cache.generate_transform_matrices(config, Mesh(filename=config['template']))
+    M, A_r, D, U, permutations = reorder.reorder_hierarchy(M, A, D, U, 'rcm')
+    for level, (a, a_r) in enumerate(zip(A, A_r)):
+        bandwidth = lambda a: np.abs(a.row - a.col).max()
+        print('level {} ({} vertices): bandwidth {} in the original order, {} in the RCM order'.format(level, a.shape[0], bandwidth(a), bandwidth(a_r)))
+    compare_models(args, 'vertex_order', ('original', 'rcm'))
+
+# parent parsers of the arguments shared by the subcommands. They are built
+# for each subcommand: the parsers of a parent share its argument objects,
+# so that set_defaults on one subcommand would change the others.
+def timing_arguments(repeat=3):
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-r', '--repeat', type=int, default=repeat)
+    return parser
+
+def network_arguments(repeat=3):
+    parser = argparse.ArgumentParser(add_help=False, parents=[timing_arguments(repeat)])
+    parser.add_argument('-c', '--conf', default=os.path.join(os.path.dirname(__file__), 'files/default.cfg'))
+    parser.add_argument('-d', '--cache_dir', help='cache directory, overrides the config file')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    return parser
+
+def model_arguments(kernel):
+    parser = argparse.ArgumentParser(add_help=False, parents=[network_arguments()])
+    parser.add_argument('-k', '--kernel', choices=['scatter', 'spmm'], default=kernel)
+    parser.add_argument('-b', '--batch_sizes', type=int, nargs='+', default=[16, 64])
+    return parser
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    layers = argparse.ArgumentParser(add_help=False, parents=[network_arguments()])
+    layers.add_argument('-b', '--batch_sizes', type=int, nargs='+', default=[16, 64, 256])
+    layers.add_argument('-K', type=int, default=6)
+    layers.add_argument('-f', '--features', type=int, default=16)
+    layers.add_argument('-l', '--levels', type=int, default=4)
+
+    parser_qslim = subparsers.add_parser('qslim', help='QSlim decimation, legacy (original implementation) vs indexed queue')
+    parser_qslim.add_argument('-t', '--template', default=os.path.join(os.path.dirname(__file__), 'template/template5k.obj'))
+    parser_qslim.add_argument('-f', '--factors', type=int, nargs='+', default=[4, 4, 4, 4])
+    parser_qslim.set_defaults(function=qslim)
+
+    parser_procrustes = subparsers.add_parser('procrustes', parents=[timing_arguments()], help='Procrustes alignment, per mesh loop vs batched')
+    parser_procrustes.add_argument('-t', '--template', default=os.path.join(os.path.dirname(__file__), 'template/template5k.obj'))
+    parser_procrustes.add_argument('-b', '--batch_size', type=int, default=256)
+    parser_procrustes.set_defaults(function=procrustes)
+
+    parser_spmm = subparsers.add_parser('spmm', parents=[layers], help='ChebConv_batch and SurfacePool, gather/scatter vs CSR SpMM (forward + backward)')
+    parser_spmm.set_defaults(function=spmm)
+
+    parser_chebyshev = subparsers.add_parser('chebyshev', parents=[layers], help='ChebConv_batch, K matmuls vs fused basis and single GEMM (forward + backward)')
+    parser_chebyshev.add_argument('-k', '--kernel', choices=['scatter', 'spmm'], default='spmm')
+    parser_chebyshev.set_defaults(function=chebyshev)
+
+    parser_layout = subparsers.add_parser('layout', parents=[model_arguments('spmm')], help='cheb_VAE, batch-major vs node-major convolution and pooling stack (forward + backward)')
+    parser_layout.set_defaults(function=layout)
+
+    parser_recompute = subparsers.add_parser('recompute', parents=[model_arguments('spmm')], help='cheb_VAE, autograd vs recomputed Chebyshev basis in the backward pass (time and saved activations)')
+    parser_recompute.set_defaults(function=recompute)
+
+    parser_reorder = subparsers.add_parser('reorder', parents=[model_arguments('scatter')], help='cheb_VAE, original vs reverse Cuthill-McKee vertex order (forward + backward)')
+    parser_reorder.set_defaults(function=vertex_order)
+
+    parser_attention = subparsers.add_parser('attention', parents=[network_arguments()], help='graph_attention, dense N x N scores vs sparse edge scores (forward + backward)')
+    parser_attention.add_argument('-b', '--batch_size', type=int, default=4)
+    parser_attention.add_argument('-H', '--heads', type=int, default=2)
+    parser_attention.add_argument('-f', '--features', type=int, default=16)
+    parser_attention.add_argument('-l', '--levels', type=int, default=5)
+    parser_attention.add_argument('--dense_max', type=int, default=1500, help='largest number of vertices for the dense layer')
+    parser_attention.set_defaults(function=attention)
+
+    parser_compile = subparsers.add_parser('compile', parents=[network_arguments(repeat=5)], help='cheb_VAE training step, eager vs compiled static encoder and decoder')
+    parser_compile.add_argument('-B', '--backend', choices=['compile', 'script'], default='compile')
+    parser_compile.add_argument('-b', '--batch_size', type=int, default=16)
+    parser_compile.set_defaults(function=compiled)
+
+    args = parser.parse_args()
+    args.function(args)
@@ -8,6 +8,13 @@ def set_default_parameters(config):
     config.set('Input Output', 'root_dir', '../project/data/mesh_edited')
     config.set('Input Output', 'error_file', '../project/files/error.txt')
     config.set('Input Output', 'log_file', '/log.txt')
+    config.set('Input Output', 'cache_dir', './cache')
+    config.set('Input Output', 'check_faces', False)
+    config.set('Input Output', 'cache_storage', 'float64')
+    config.set('Input Output', 'alignment', 'template')
+    config.set('Input Output', 'dataset', 'memory')
+    config.set('Input Output', 'block_size', 256)
+    config.set('Input Output', 'block_cache_bytes', 1073741824)
     
     config.set('Input Output', 'type', 'cheb_VAE')
     config.set('Input Output', 'num_classes', '2')
@@ -30,12 +37,19 @@ def set_default_parameters(config):
     config.set('ChebModel  Parameters', 'polygon_order', '6, 6, 6')
     config.set('ChebModel  Parameters', 'num_conv_filters', '16, 16, 16')
     config.set('ChebModel  Parameters', 'workers_thread', 6)
+    config.set('ChebModel  Parameters', 'conv_kernel', 'scatter')
+    config.set('ChebModel  Parameters', 'fused_chebyshev', False)
+    config.set('ChebModel  Parameters', 'node_major', False)
+    config.set('ChebModel  Parameters', 'recompute_chebyshev', False)
+    config.set('ChebModel  Parameters', 'vertex_order', 'original')
 
 
     config.add_section('Learning Parameters')
     config.set('Learning Parameters', 'optimizer', 'adam')
     config.set('Learning Parameters', 'save', 'best_loss')
     config.set('Learning Parameters', 'batch_size', 16)
+    config.set('Learning Parameters', 'loader', 'graph')
+    config.set('Learning Parameters', 'num_workers', 0)
     config.set('Learning Parameters', 'learning_rate', 1e-3)
     config.set('Learning Parameters', 'learning_rates', "0.001, 0.0001")
     config.set('Learning Parameters', 'learning_rates_epochs', "500, 10000")
@@ -61,6 +75,13 @@ def read_config(fname):
     config_parms['template'] = config.get('Input Output', 'template')
     config_parms['error_file'] = config.get('Input Output', 'error_file')
     config_parms['log_file'] = os.path.join( config_parms['checkpoint_dir'], config.get('Input Output', 'log_file') )
+    config_parms['cache_dir'] = config.get('Input Output', 'cache_dir', fallback = './cache')
+    config_parms['check_faces'] = config.getboolean('Input Output', 'check_faces', fallback = False)
+    config_parms['cache_storage'] = config.get('Input Output', 'cache_storage', fallback = 'float64')
+    config_parms['alignment'] = config.get('Input Output', 'alignment', fallback = 'template')
+    config_parms['dataset'] = config.get('Input Output', 'dataset', fallback = 'memory')
+    config_parms['block_size'] = config.getint('Input Output', 'block_size', fallback = 256)
+    config_parms['block_cache_bytes'] = config.getint('Input Output', 'block_cache_bytes', fallback = 1073741824)
     config_parms['type'] = config.get('Input Output', 'type')
     config_parms['num_classes'] = config.getint('Input Output', 'num_classes')
     config_parms['num_style'] = config.getint('Input Output', 'num_style')
@@ -75,12 +96,19 @@ def read_config(fname):
     config_parms['downsampling_factors'] =  [int(x) for x in config.get('ChebModel  Parameters', 'downsampling_factors').split(',')]
     config_parms['num_conv_filters'] = [int(x) for x in config.get('ChebModel  Parameters', 'num_conv_filters').split(',')]
     config_parms['workers_thread'] = config.getint('ChebModel  Parameters', 'workers_thread')
+    config_parms['conv_kernel'] = config.get('ChebModel  Parameters', 'conv_kernel', fallback = 'scatter')
+    config_parms['fused_chebyshev'] = config.getboolean('ChebModel  Parameters', 'fused_chebyshev', fallback = False)
+    config_parms['node_major'] = config.getboolean('ChebModel  Parameters', 'node_major', fallback = False)
+    config_parms['vertex_order'] = config.get('ChebModel  Parameters', 'vertex_order', fallback = 'original')
+    config_parms['recompute_chebyshev'] = config.getboolean('ChebModel  Parameters', 'recompute_chebyshev', fallback = False)
     config_parms['polygon_order'] = [int(x) for x in config.get('ChebModel  Parameters', 'polygon_order').split(',')]
 
 
     config_parms['optimizer'] = config.get('Learning Parameters', 'optimizer')
     config_parms['save'] = config.get('Learning Parameters', 'save')
     config_parms['batch_size'] = config.getint('Learning Parameters', 'batch_size')
+    config_parms['loader'] = config.get('Learning Parameters', 'loader', fallback = 'graph')
+    config_parms['num_workers'] = config.getint('Learning Parameters', 'num_workers', fallback = 0)
     config_parms['learning_rate'] = config.getfloat('Learning Parameters', 'learning_rate')
     config_parms['learning_rates'] = [float(x) for x in config.get('Learning Parameters', 'learning_rates').split(',')]
     config_parms['learning_rates_epochs'] = [float(x) for x in config.get('Learning Parameters', 'learning_rates_epochs').split(',')]
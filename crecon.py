@@ -13,11 +13,10 @@ import json
 import os
 import numpy as np
 import torch.nn.functional as F
-from torch_geometric.loader import DataLoader
 import torch_geometric
 import mesh_operations
 import plotLosses
-from data import MeshData, listMeshes, save_obj
+from data import get_dataset, get_loader, get_registry, listMeshes, save_obj
 from model import get_model, classifier_, save_model
 from transform import Normalize
 from utils import *
@@ -194,8 +193,8 @@ def main(args):
         if args.all : models = range( 1, 1 + config[ "folds" ] )
         else : models = [ args.model ]
         net, _unused = get_model(config, device, model_type="cheb_GCN")
-        inference_dataset = MeshData(dataset_index, config, labels, dtype = 'test', template = template, pre_transform = Normalize())
-        inference_loader = DataLoader(inference_dataset, batch_size=batch_size, shuffle=False)
+        inference_dataset = get_dataset(dataset_index, config, labels, dtype = 'test', template = template, pre_transform = Normalize())
+        inference_loader = get_loader(inference_dataset, config, batch_size, shuffle=False)
 
         for i in models:
             checkpoint_file = os.path.join(checkpoint_dir, 'checkpoint_'+ str(i)+'.pt')
@@ -218,6 +217,8 @@ def main(args):
     skf = RepeatedStratifiedKFold(n_splits=config['folds'], n_repeats=1, random_state = random_seeds)
     n = 0
     y = np.ones(len(dataset_index))
+    # meshes are loaded once, each fold only selects its rows
+    registry = get_registry(dataset_index, config, labels, template, fit_alignment = args.train)
 
     for train_index, test_index in skf.split(dataset_index, y):
         train_, valid_index = train_test_split(np.array(dataset_index)[train_index], test_size=config['test_size'], random_state = random_seeds)
@@ -230,11 +231,11 @@ def main(args):
         if args.train:
 
             best_val_acc = 0
-            train_dataset = MeshData(train_, config, labels, dtype = 'train', template = template, pre_transform = Normalize())
-            train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
+            train_dataset = get_dataset(train_, config, labels, dtype = 'train', template = template, pre_transform = Normalize(), registry = registry)
+            train_loader = get_loader(train_dataset, config, batch_size, shuffle=True)
 
-            valid_dataset = MeshData(valid_index, config, labels, dtype = 'test', template = template, pre_transform = Normalize())
-            valid_loader = DataLoader(valid_dataset, batch_size=batch_size, shuffle=True)
+            valid_dataset = get_dataset(valid_index, config, labels, dtype = 'test', template = template, pre_transform = Normalize(), registry = registry)
+            valid_loader = get_loader(valid_dataset, config, batch_size, shuffle=True)
 
             for epoch in range(1, total_epochs + 1):
                 begin = time.time()
@@ -271,8 +272,8 @@ def main(args):
                 net.load_state_dict(checkpoint['state_dict'])
                 history.append( {} )
 
-            test_dataset = MeshData(np.array(dataset_index)[test_index], config, labels, dtype = 'test', template = template, pre_transform = Normalize())  
-            test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
+            test_dataset = get_dataset(np.array(dataset_index)[test_index], config, labels, dtype = 'test', template = template, pre_transform = Normalize(), registry = registry)  
+            test_loader = get_loader(test_dataset, config, batch_size, shuffle=False)
             test_loss, test_acc, _ = evaluate(net, dvae, test_loader, device, criterion, err_file = False)
 
             print( 'test loss ', test_loss, 'test acc',test_acc)
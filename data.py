@@ -1,29 +1,30 @@
-import copy
-import mesh_operations
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import os
+import re
+import time
 from psbody.mesh import Mesh
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import BatchSampler, Dataset, RandomSampler, SequentialSampler
+from dataset_cache import ARRAYS, DatasetCache
+from mesh_shards import BlockSampler, MeshShards, shard_directory
 from torch_geometric.data import Data
-from utils import procrustes
+from torch_geometric.loader import DataLoader
+from topology import get_topology, open3d_order
+from tqdm import tqdm
+from utils import generalized_procrustes, generalized_procrustes_blocks, procrustes_batch
+
+# reorders vertices and faces the same way open3d does
+def reorder_like_open3d( v, f ):
+    order, indices = open3d_order( f, v.shape[ 0 ] )
+    coords = np.copy( v )
+    coords[ : len( order ) ] = v[ order ]
+    return coords, indices[ f ].astype( f.dtype )
 
 # this function loads a mesh and reorders its vertices the same way open3d does
 def Mesh2( filename = "none" ):
     mesh = Mesh( filename=filename )
-    indices = np.full( shape = mesh.v.shape[ 0 ], fill_value= -1 )
-    coords = np.copy( mesh.v )
-    counter = 0
-    for i in range( mesh.f.shape[ 0 ] ) :
-        for j in range( 3 ) :
-            vertex = mesh.f[ i ][ j ]
-            if indices[ vertex ] < 0:
-                indices[ vertex ] = counter
-                coords[ counter ] = mesh.v[ vertex ]
-                counter += 1
-            mesh.f[ i ][ j ] = indices[ vertex ]
-
-    mesh.v = coords
+    mesh.v, mesh.f = reorder_like_open3d( mesh.v, mesh.f )
     return mesh
 
 def save_obj(filename, vertices, faces):
@@ -34,6 +35,83 @@ def save_obj(filename, vertices, faces):
         for f in faces + 1:
             fp.write('f %d %d %d\n' % (f[0], f[1], f[2]))
 
+_vertex_pattern = re.compile( rb'^v[ \t]+(\S+)[ \t]+(\S+)[ \t]+(\S+)', re.M )
+_face_pattern = re.compile( rb'^f[ \t]+(\d+)\S*[ \t]+(\d+)\S*[ \t]+(\d+)', re.M )
+
+# fast OBJ reader : only the "v" lines are parsed, unless faces are requested.
+# The string to float conversion is done by numpy in a single call.
+def read_obj( filename, num_vertices = None, faces = False ):
+    with open( filename, 'rb' ) as fp:
+        content = fp.read()
+
+    v = np.array( _vertex_pattern.findall( content ), dtype = bytes ).astype( np.float64 ).reshape( -1, 3 )
+    if num_vertices is not None and v.shape[ 0 ] != num_vertices:
+        raise ValueError( "{} : {} vertices, expected {}".format( filename, v.shape[ 0 ], num_vertices ) )
+
+    if not faces : return v
+    f = np.array( _face_pattern.findall( content ), dtype = bytes ).astype( np.int64 ).reshape( -1, 3 ) - 1
+    return v, f
+
+def _read_file( args ):
+    filename, num_vertices, faces = args
+    if faces : return read_obj( filename, num_vertices, faces = True )
+    return read_obj( filename, num_vertices ), None
+
+# reads obj files in a pool of worker processes, returns ( vertices, faces ) numpy arrays in the
+# order of files. faces is a boolean or a list of booleans telling for which files faces are read.
+def read_files( files, num_vertices, faces = False, workers = 1, progress = True ):
+    if isinstance( faces, bool ) : faces = [ faces ] * len( files )
+    tasks = [ ( file, num_vertices, f ) for file, f in zip( files, faces ) ]
+    disable = not progress or len( files ) == 0
+    if workers <= 1 or len( files ) < 2 * workers:
+        return [ _read_file( task ) for task in tqdm( tasks, desc = "reading meshes", disable = disable ) ]
+    chunksize = max( 1, min( 32, len( tasks ) // ( 4 * workers ) ) )
+    with ProcessPoolExecutor( max_workers = workers ) as pool:
+        return list( tqdm( pool.map( _read_file, tasks, chunksize = chunksize ), total = len( tasks ), desc = "reading meshes", disable = disable ) )
+
+# aligns a ( B, N, 3 ) stack of meshes on the template in one batched procrustes
+def align_meshes( points, template ):
+    mtx1, mtx2, disparity, res = procrustes_batch( template, points )
+    return { "raw" : points, "aligned" : mtx2, "R" : res[ 0 ], "s" : res[ 1 ], "m" : res[ 2 ] }
+
+# reads the vertices of meshes, without aligning them. Returns the list of
+# vertex arrays and the faces shared by the meshes (faces if already known).
+def read_meshes( files, num_vertices, config, faces = None ):
+    check_faces = config.get( "check_faces", False )
+    points = []
+    # faces are read for the first mesh only, unless they are checked
+    read_faces = [ check_faces or ( faces is None and j == 0 ) for j in range( len( files ) ) ]
+    for file, ( v, f ) in zip( files, read_files( files, num_vertices, read_faces, config.get( "workers_thread", 1 ) ) ):
+        if f is not None:
+            if faces is None : faces = f
+            elif not np.array_equal( faces, f ):
+                raise ValueError( "{} : faces differ from the ones of the dataset".format( file ) )
+        points.append( v )
+    return points, faces
+
+# loads and aligns meshes, returns stacked arrays (raw vertices, aligned vertices, R, s, m)
+# and the faces shared by the meshes. When config[ "cache_dir" ] is set, the preprocessed
+# meshes are stored in a dataset_cache.DatasetCache and the files are only read once.
+def load_meshes( files, template, config ):
+    cache = None
+    rows = np.full( len( files ), -1 )
+    if config.get( "cache_dir" ):
+        cache = DatasetCache( config[ "cache_dir" ], template, config.get( "cache_storage", "float64" ) )
+        rows = cache.lookup( files )
+
+    missing = np.flatnonzero( rows < 0 )
+    points, faces = read_meshes( [ files[ i ] for i in missing ], len( template ), config, cache.faces if cache is not None else None )
+
+    if len( points ) : arrays = align_meshes( np.stack( points ), template )
+    else : arrays = { k : np.zeros( ( 0, ) ) for k in [ "raw", "aligned", "R", "s", "m" ] }
+    if cache is None : return arrays, faces
+
+    if len( points ):
+        cache.write( [ files[ i ] for i in missing ], arrays, faces )
+        rows = cache.lookup( files )
+    print( "{} meshes read from cache, {} meshes loaded".format( len( files ) - len( points ), len( points ) ) )
+    return cache.read( rows ), cache.faces
+
 def OnUnitCube(data):
     max_, _ = torch.max(data.x, dim = 0)  # [N, D]  =>  [1, D]
     min_, _ = torch.min(data.x, dim = 0) 
@@ -82,62 +160,340 @@ def listMeshes( config, getSexFromFileName = True ) :
     return dataset_index, labels
 
 
+class MeshRegistry(object):
+    """All the meshes of a dataset index, loaded and aligned once.
+
+    MeshData objects built with registry = ... only hold the rows of their
+    meshes, so that the k-fold loops share a single copy of the dataset.
+
+    With config[ 'alignment' ] = 'gpa', the meshes are aligned on their mean
+    shape by generalized Procrustes analysis instead of on the template. When
+    fit_alignment is True (training) the mean is computed from the raw meshes
+    and saved to gpa.npz in the checkpoint directory, otherwise the saved mean
+    is loaded and used as alignment reference (testing, inference)."""
+    def __init__(self, dataset_index, config, label, template, fit_alignment = False):
+        self.filename = []
+        self.data_label = []
+        self.row = {}
+        for fileName in dataset_index:
+            file = os.path.join(config[ 'root_dir' ], fileName )
+            if not os.path.exists(file) : continue
+            self.row[fileName] = len(self.filename)
+            self.filename.append(file)
+            self.data_label.append(label[fileName])
+
+        gpa_file = os.path.join(config['checkpoint_dir'], 'gpa.npz')
+        alignment = config.get('alignment', 'template')
+        assert alignment in ['template', 'gpa'], 'Invalid alignment'
+        gpa = alignment == 'gpa'
+        if gpa and fit_alignment and len(self.filename):
+            # the meshes are aligned by the GPA only, not on the template first
+            points, faces = read_meshes(self.filename, len(template), config)
+            points = np.stack(points)
+            begin = time.time()
+            mean, iterations, aligned, disparity, res = generalized_procrustes(points, template)
+            arrays = {'raw': points, 'aligned': aligned, 'R': res[0], 's': res[1], 'm': res[2]}
+            np.savez(gpa_file, mean = mean, files = np.array(self.filename), R = res[0], s = res[1], m = res[2])
+            print('GPA converged in {} iterations ({:.2f}s), mean disparity {:.3e}'.format(iterations, time.time() - begin, disparity.mean()))
+        elif gpa and len(self.filename):
+            arrays, faces = load_meshes(self.filename, np.load(gpa_file)['mean'], config)
+        else:
+            arrays, faces = load_meshes(self.filename, template, config)
+
+        # contiguous float32 struct of arrays: raw and aligned vertices (B, N, 3),
+        # R (B, 3, 3), s (B) and m (B, 3), shared by all the MeshData of the registry
+        self.tensors = {k: torch.from_numpy(np.ascontiguousarray(arrays[k], dtype=np.float32)) for k in ARRAYS}
+        self.tensors['y'] = torch.tensor(self.data_label, dtype=torch.int64)
+        # loader workers and child processes attach to the tensors instead of
+        # copying them (within a process, the folds use them by reference)
+        if config.get('num_workers', 0) > 0:
+            for t in self.tensors.values(): t.share_memory_()
+        self.edge_index = None
+        if len(self.filename):
+            self.edge_index = get_topology(faces, len(template)).edge_index
+
+    def rows(self, dataset_index):
+        return np.array([self.row[fileName] for fileName in dataset_index if fileName in self.row], dtype=np.int64)
+
+# binds the mean and std saved in checkpoint_dir to the Normalize transform pre_transform,
+# returns the saved statistics and the bound mean and std as float64 tensors
+def bind_normalization( pre_transform, checkpoint_dir ):
+    # read into a dict, so that datasets can be sent to loader worker processes
+    with np.load(os.path.join(checkpoint_dir, 'norm.npz'), allow_pickle = True) as d:
+        norm_dict = {'mean': d['mean'], 'std': d['std']}
+    mean = norm_dict['mean']
+    std = norm_dict['std']
+    if hasattr(pre_transform, 'mean') and hasattr(pre_transform, 'std'):
+        if pre_transform.mean is None:
+            pre_transform.mean = mean
+        if pre_transform.std is None:
+            pre_transform.std = std
+    mean = torch.as_tensor(pre_transform.mean, dtype=torch.float64)
+    std = torch.as_tensor(pre_transform.std, dtype=torch.float64)
+    return norm_dict, mean, std
+
 class MeshData(Dataset):
-    def __init__(self, dataset_index , config, label,  template, dtype = 'train',   pre_transform = None):
+    """Dataset of aligned meshes. The samples are read from the tensors of
+    the registry, which all the folds, loaders and worker processes share,
+    and normalized when accessed: a dataset only holds its rows."""
+    def __init__(self, dataset_index , config, label,  template, dtype = 'train',   pre_transform = None, registry = None):
         checkpoint_dir = config['checkpoint_dir']
         self.pre_transform = pre_transform
+        if registry is None:
+            registry = MeshRegistry(dataset_index, config, label, template)
+            self.rows = np.arange(len(registry.filename))
+        else:
+            self.rows = registry.rows(dataset_index)
+
+        self.registry = registry
+        self.tensors = registry.tensors
+        self.edge_index = registry.edge_index
+
+        if dtype == 'train' and not os.path.exists(os.path.join(checkpoint_dir,'norm')):
+            aligned = self.tensors['aligned'][torch.from_numpy(self.rows)].numpy()
+            mean_train = np.mean(aligned, axis=0, dtype=np.float64)
+            std_train = np.std(aligned, axis=0, dtype=np.float64)
+            self.norm_dict = {'mean': mean_train, 'std': std_train}
+            np.savez(os.path.join(checkpoint_dir,'norm'), mean = mean_train, std = std_train)
+
+        self.mean = self.std = None
+        if pre_transform is not None:
+            self.norm_dict, self.mean, self.std = bind_normalization(pre_transform, checkpoint_dir)
+
+        print( dtype, " dataset has been created, number of {} samples:".format(dtype), len(self.rows) )
+
+    def __len__(self):
+        return len( self.rows )
+
+    def normalize(self, aligned):
+        if self.mean is None: return aligned
+        return ((aligned.double() - self.mean) / self.std).float()
+
+    def __getitem__(self, idx):
+        row = self.rows[idx]
+        x = self.normalize(self.tensors['aligned'][row])
+        data_ = Data(x=x, y=x, edge_index=self.edge_index)
+        t = self.tensors
+        return data_, x, self.registry.data_label[row], self.registry.filename[row], t['raw'][row], t['R'][row], t['m'][row:row + 1], t['s'][row:row + 1]
+
+    def get_batch(self, indices):
+        """Batch of samples as dense tensors, in the same layout as the items
+        collated by the torch_geometric DataLoader, except for x which is a
+        (B, N, 3) tensor instead of a Batch object."""
+        indices = torch.as_tensor(indices, dtype=torch.int64)
+        rows = torch.from_numpy(self.rows)[indices]
+        filenames = [self.registry.filename[row] for row in rows.tolist()]
+        t = self.tensors
+        x = self.normalize(t['aligned'][rows])
+        return x, x, t['y'][rows], filenames, t['raw'][rows], t['R'][rows], t['m'][rows].unsqueeze(1), t['s'][rows].unsqueeze(1)
+
+# iterator over the raw vertices of the blocks of complete shards
+def raw_blocks( shards ):
+    for block in range( shards.num_blocks ):
+        yield shards.block( block )[ "raw" ].numpy()
+
+class LazyMeshRegistry(object):
+    """Out of core counterpart of MeshRegistry. The meshes are preprocessed
+    once into mesh_shards blocks of config[ 'block_size' ] meshes in
+    config[ 'cache_dir' ], and read on demand through an LRU cache bounded by
+    config[ 'block_cache_bytes' ] bytes.
+
+    With config[ 'alignment' ] = 'gpa' and fit_alignment, the GPA mean is
+    fitted by streaming the raw meshes of the template aligned shards, then
+    the meshes are aligned on it into a second set of shards."""
+    def __init__(self, dataset_index, config, label, template, fit_alignment = False):
+        assert config.get('cache_dir'), 'the lazy dataset needs a cache_dir'
         self.filename = []
         self.data_label = []
-        self.ori_mesh = []
-        self.R = []
-        self.s = []
-        self.m = []
-        self.ori_data = []
-        self.edge_index = None
-  
+        self.row = {}
         for fileName in dataset_index:
             file = os.path.join(config[ 'root_dir' ], fileName )
             if not os.path.exists(file) : continue
+            self.row[fileName] = len(self.filename)
             self.filename.append(file)
-            mesh = Mesh(filename=file)
-            # points, s, mean_points = OnUnitCube(np.array(mesh.v))
-            points = np.array(mesh.v) 
-            self.ori_mesh.append(torch.Tensor(points))
-            mtx1, mtx2, disparity, res= procrustes(template,points)
-            ori_mtx = copy.copy(mtx2)
-            self.ori_data.append(ori_mtx)
             self.data_label.append(label[fileName])
-            self.R.append(torch.FloatTensor(res[0]))
-            self.s.append(torch.FloatTensor([res[1]]))
-            self.m.append(torch.FloatTensor(np.array([res[2]])))
-            if self.edge_index is None:
-                adjacency = mesh_operations.get_vert_connectivity(mesh.v, mesh.f).tocoo()
-                self.edge_index = torch.Tensor(np.vstack((adjacency.row, adjacency.col))).long()
+        self.labels = torch.tensor(self.data_label, dtype=torch.int64)
+
+        reference = template
+        gpa_file = os.path.join(config['checkpoint_dir'], 'gpa.npz')
+        alignment = config.get('alignment', 'template')
+        assert alignment in ['template', 'gpa'], 'Invalid alignment'
+        fit_gpa = alignment == 'gpa' and fit_alignment
+        if alignment == 'gpa' and not fit_alignment:
+            reference = np.load(gpa_file)['mean']
+
+        if not len(self.filename):
+            raise ValueError('no mesh of the dataset index found in root_dir {}'.format(config['root_dir']))
+        self.shards = self.open_shards(reference, config)
+        if not self.shards.complete(): self.build(reference, config)
+        if fit_gpa:
+            begin = time.time()
+            mean, iterations, res = generalized_procrustes_blocks(lambda: raw_blocks(self.shards), template)
+            np.savez(gpa_file, mean = mean, files = np.array(self.filename), R = res[0], s = res[1], m = res[2])
+            print('GPA converged in {} iterations ({:.2f}s)'.format(iterations, time.time() - begin))
+            raw = self.shards
+            self.shards = self.open_shards(mean, config)
+            if not self.shards.complete(): self.realign(raw, mean)
+        self.edge_index = get_topology(self.shards.faces, len(template)).edge_index
+
+    def open_shards(self, reference, config):
+        """Shards of the meshes aligned on reference, opened if complete."""
+        shards = MeshShards(shard_directory(config['cache_dir'], reference, self.filename), config.get('block_cache_bytes', 1 << 30))
+        if shards.complete(): shards.open()
+        return shards
+
+    def realign(self, source, reference):
+        """Writes the shards of the raw meshes of source aligned on reference."""
+        for block, points in enumerate(tqdm(raw_blocks(source), desc = "aligning shards")):
+            self.shards.write_block(block, align_meshes(points, reference))
+        self.shards.finish(self.filename, source.block_size, source.faces)
+
+    def build(self, reference, config):
+        block_size = config.get('block_size', 256)
+        check_faces = config.get('check_faces', False)
+        faces = None
+        for block, begin in enumerate(tqdm(range(0, len(self.filename), block_size), desc = "writing shards")):
+            files = self.filename[begin:begin + block_size]
+            read_faces = [check_faces or (faces is None and j == 0) for j in range(len(files))]
+            points = []
+            for file, (v, f) in zip(files, read_files(files, len(reference), read_faces, config.get('workers_thread', 1), progress = False)):
+                if f is not None:
+                    if faces is None : faces = f
+                    elif not np.array_equal(faces, f):
+                        raise ValueError( "{} : faces differ from the ones of the dataset".format( file ) )
+                points.append(v)
+            self.shards.write_block(block, align_meshes(np.stack(points), reference))
+        self.shards.finish(self.filename, block_size, faces)
+        print('{} meshes written to {}'.format(len(self.filename), self.shards.directory))
+
+    def rows(self, dataset_index):
+        return np.array([self.row[fileName] for fileName in dataset_index if fileName in self.row], dtype=np.int64)
+
+    def get(self, rows):
+        return self.shards.get(rows)
+
+class LazyMeshData(Dataset):
+    """MeshData over a LazyMeshRegistry: samples are read from the shards
+    when accessed and normalized per batch, so that memory use does not grow
+    with the number of meshes."""
+    def __init__(self, dataset_index , config, label,  template, dtype = 'train',   pre_transform = None, registry = None):
+        checkpoint_dir = config['checkpoint_dir']
+        self.pre_transform = pre_transform
+        if registry is None:
+            registry = LazyMeshRegistry(dataset_index, config, label, template)
+            self.rows = np.arange(len(registry.filename))
+        else:
+            self.rows = registry.rows(dataset_index)
+
+        self.registry = registry
+        self.edge_index = registry.edge_index
 
         if dtype == 'train' and not os.path.exists(os.path.join(checkpoint_dir,'norm')):
-            mean_train = np.mean(self.ori_data, axis=0)
-            std_train = np.std(self.ori_data, axis=0)
+            mean_train, std_train = self.statistics(config.get('block_size', 256))
             self.norm_dict = {'mean': mean_train, 'std': std_train}
             np.savez(os.path.join(checkpoint_dir,'norm'), mean = mean_train, std = std_train)
 
+        self.mean = self.std = None
         if pre_transform is not None:
-            self.norm_dict = np.load(os.path.join(checkpoint_dir, 'norm.npz'), allow_pickle = True)
-            mean = self.norm_dict['mean']
-            std = self.norm_dict['std']
-            if hasattr(pre_transform, 'mean') and hasattr(pre_transform, 'std'):
-                if pre_transform.mean is None:
-                    pre_transform.mean = mean
-                if pre_transform.std is None:
-                    pre_transform.std = std
+            self.norm_dict, self.mean, self.std = bind_normalization(pre_transform, checkpoint_dir)
+
+        print( dtype, " dataset has been created, number of {} samples:".format(dtype), len(self.rows) )
+
+    def statistics(self, chunk_size):
+        """Mean and std of the aligned meshes, accumulated in float64 one
+        chunk at a time (Chan et al. pairwise update)."""
+        rows = np.sort(self.rows)
+        count, mean, M2 = 0, 0, 0
+        for begin in range(0, len(rows), chunk_size):
+            aligned = self.registry.get(rows[begin:begin + chunk_size])['aligned'].double()
+            n = aligned.shape[0]
+            chunk_mean = aligned.mean(0)
+            delta = chunk_mean - mean
+            M2 = M2 + ((aligned - chunk_mean) ** 2).sum(0) + delta ** 2 * count * n / (count + n)
+            mean = mean + delta * n / (count + n)
+            count += n
+        return mean.numpy(), (M2 / count).sqrt().numpy()
 
-        print( dtype, " dataset has been created, number of {} samples:".format(dtype), len(self.ori_data) )
+    def normalize(self, aligned):
+        if self.mean is None: return aligned
+        return ((aligned.double() - self.mean) / self.std).float()
+
+    def block_sampler(self):
+        return BlockSampler(self.rows, self.registry.shards.block_size)
 
     def __len__(self):
-        return len( self.ori_data )
+        return len( self.rows )
 
     def __getitem__(self, idx):
-        normalized_data = (torch.tensor(self.ori_data[idx])-self.pre_transform.mean)/ self.pre_transform.std
-        mesh_verts = copy.copy(normalized_data).float()
-        data_ = Data(x=mesh_verts, y=mesh_verts, edge_index=self.edge_index)
-        return data_, normalized_data , self.data_label[idx], self.filename[idx],self.ori_mesh[idx], self.R[idx], self.m[idx], self.s[idx]
+        row = self.rows[idx]
+        t = self.registry.get([row])
+        x = self.normalize(t['aligned'][0])
+        data_ = Data(x=x, y=x, edge_index=self.edge_index)
+        return data_, x, self.registry.data_label[row], self.registry.filename[row], t['raw'][0], t['R'][0], t['m'], t['s']
+
+    def get_batch(self, indices):
+        """Same as MeshData.get_batch."""
+        indices = torch.as_tensor(indices, dtype=torch.int64)
+        rows = torch.from_numpy(self.rows)[indices]
+        filenames = [self.registry.filename[row] for row in rows.tolist()]
+        t = self.registry.get(rows)
+        x = self.normalize(t['aligned'])
+        return x, x, self.registry.labels[rows], filenames, t['raw'], t['R'], t['m'].unsqueeze(1), t['s'].unsqueeze(1)
+
+# returns a mesh registry of the type given by config[ "dataset" ] ( "memory" or "lazy" )
+def get_registry( dataset_index, config, label, template, fit_alignment = False ):
+    dataset = config.get( "dataset", "memory" )
+    assert dataset in [ "memory", "lazy" ], "Invalid dataset"
+    if dataset == "lazy" : return LazyMeshRegistry( dataset_index, config, label, template, fit_alignment )
+    return MeshRegistry( dataset_index, config, label, template, fit_alignment )
+
+# returns a MeshData or a LazyMeshData, depending on config[ "dataset" ]
+def get_dataset( dataset_index, config, label, template, dtype = 'train', pre_transform = None, registry = None ):
+    dataset = config.get( "dataset", "memory" )
+    assert dataset in [ "memory", "lazy" ], "Invalid dataset"
+    if dataset == "lazy" : return LazyMeshData( dataset_index, config, label, template, dtype, pre_transform, registry )
+    return MeshData( dataset_index, config, label, template, dtype, pre_transform, registry )
+
+class _Batches(Dataset):
+    # dataset of whole batches, for DenseLoader workers
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, indices):
+        return self.dataset.get_batch(indices)
+
+class DenseLoader(object):
+    """Loader yielding dense (B, N, 3) batches of a MeshData by slicing its
+    preallocated storage, without building per-sample Data objects. With
+    num_workers > 0, batches are sliced by worker processes which share the
+    dataset tensors."""
+    def __init__(self, dataset, batch_size = 1, shuffle = False, drop_last = False, sampler = None, num_workers = 0):
+        self.dataset = dataset
+        if sampler is None: sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+        self.batch_sampler = BatchSampler(sampler, batch_size, drop_last)
+        self.num_workers = num_workers
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def __iter__(self):
+        if self.num_workers > 0:
+            yield from torch.utils.data.DataLoader(_Batches(self.dataset), sampler = self.batch_sampler,
+                                                   batch_size = None, num_workers = self.num_workers)
+            return
+        for indices in self.batch_sampler:
+            yield self.dataset.get_batch(indices)
 
+# returns a loader for dataset, of the type given by config[ "loader" ] ( "dense" or "graph" ),
+# with config[ "num_workers" ] worker processes. Lazy datasets are shuffled block by block.
+def get_loader( dataset, config, batch_size, shuffle = False ):
+    loader = config.get( "loader", "graph" )
+    assert loader in [ "dense", "graph" ], "Invalid loader"
+    num_workers = config.get( "num_workers", 0 )
+    sampler = dataset.block_sampler() if shuffle and hasattr( dataset, "block_sampler" ) else None
+    if loader == "dense" : return DenseLoader( dataset, batch_size = batch_size, shuffle = shuffle, sampler = sampler, num_workers = num_workers )
+    if sampler is not None : return DataLoader( dataset, batch_size = batch_size, sampler = sampler, num_workers = num_workers )
+    return DataLoader( dataset, batch_size = batch_size, shuffle = shuffle, num_workers = num_workers )
@@ -0,0 +1,123 @@
+"""
+Cache of the preprocessed meshes of a dataset.
+
+For a given template, the raw vertices, the vertices aligned on the template
+and the R/s/m Procrustes parameters of every mesh are stored as contiguous
+.npy arrays which are memory-mapped when read. A manifest records the path,
+modification time and size of each source file, so that modified files are
+detected without reading them.
+
+With storage = 'float16', only the aligned vertices are stored, as float16
+offsets from the standardized template, and the raw vertices are recovered
+from the Procrustes parameters.
+"""
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+import time
+
+# bump this whenever the content of the cached arrays changes
+CACHE_VERSION = 1
+
+ARRAYS = ['raw', 'aligned', 'R', 's', 'm']
+
+def file_signature(filename):
+    stat = os.stat(filename)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def standardized_template(template):
+    template = np.array(template, dtype=np.float64)
+    template -= np.mean(template, 0)
+    return template / np.linalg.norm(template)
+
+class DatasetCache(object):
+    def __init__(self, cache_dir, template, storage='float64'):
+        assert storage in ['float64', 'float16'], 'Invalid storage'
+        template = np.ascontiguousarray(template, dtype=np.float64)
+        key = hashlib.sha1(template.tobytes()).hexdigest()[:16]
+        self.directory = os.path.join(cache_dir, 'datasets', 'v' + str(CACHE_VERSION), key + '_' + storage)
+        self.manifest = os.path.join(self.directory, 'manifest.json')
+        self.storage = storage
+        self.template = standardized_template(template)
+        self.files = {}
+        self.generation = None
+        self.arrays = None
+        self.faces = None
+        if os.path.exists(self.manifest):
+            with open(self.manifest) as f:
+                manifest = json.load(f)
+            self.files = manifest['files']
+            self._open(manifest['generation'])
+
+    def _stored_arrays(self):
+        if self.storage == 'float16': return ['delta', 'R', 's', 'm']
+        return ARRAYS
+
+    def _open(self, generation):
+        self.generation = generation
+        directory = os.path.join(self.directory, generation)
+        self.arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in self._stored_arrays()}
+        self.faces = np.load(os.path.join(directory, 'faces.npy'))
+
+    def lookup(self, files):
+        """Returns the cache rows of files (-1 for missing or outdated files)."""
+        rows = np.full(len(files), -1, dtype=np.int64)
+        for i, file in enumerate(files):
+            entry = self.files.get(os.path.abspath(file))
+            if entry is not None and entry['signature'] == file_signature(file):
+                rows[i] = entry['row']
+        return rows
+
+    def read(self, rows):
+        """Returns raw, aligned, R, s and m for the given cache rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.storage == 'float64':
+            return {name: np.asarray(self.arrays[name][rows]) for name in ARRAYS}
+
+        out = {name: np.asarray(self.arrays[name][rows]) for name in ['R', 's', 'm']}
+        out['aligned'] = self.template + self.arrays['delta'][rows].astype(np.float64)
+        out['raw'] = np.matmul(out['aligned'] * out['s'][:, None, None], out['R']) + out['m'][:, None, :]
+        return out
+
+    def write(self, files, arrays, faces):
+        """Adds (or replaces) files in the cache. arrays holds raw, aligned,
+        R, s and m for each file, in the order of files, faces are the faces
+        shared by all the meshes."""
+        replaced = set(os.path.abspath(file) for file in files)
+        kept = [(path, entry) for path, entry in self.files.items() if path not in replaced]
+        keep_rows = np.array([entry['row'] for path, entry in kept], dtype=np.int64)
+
+        if self.storage == 'float16':
+            arrays = {'delta': (np.asarray(arrays['aligned']) - self.template).astype(np.float16),
+                      'R': arrays['R'], 's': arrays['s'], 'm': arrays['m']}
+
+        # each update is written to a new generation directory, and the
+        # manifest is switched last: an interrupted update leaves the old cache valid
+        generation = '{}_{}'.format(time.time_ns(), os.getpid())
+        directory = os.path.join(self.directory, generation)
+        os.makedirs(directory)
+        for name in self._stored_arrays():
+            new_rows = np.asarray(arrays[name])
+            if len(kept):
+                old_rows = np.asarray(self.arrays[name][keep_rows])
+                new_rows = np.concatenate((old_rows, new_rows.astype(old_rows.dtype)))
+            np.save(os.path.join(directory, name + '.npy'), np.ascontiguousarray(new_rows))
+        np.save(os.path.join(directory, 'faces.npy'), faces)
+
+        files_ = {}
+        for row, (path, entry) in enumerate(kept):
+            files_[path] = {'row': row, 'signature': entry['signature']}
+        for row, file in enumerate(files):
+            files_[os.path.abspath(file)] = {'row': len(kept) + row, 'signature': file_signature(file)}
+
+        with open(self.manifest + '.tmp', 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'storage': self.storage, 'generation': generation, 'files': files_}, f)
+        os.replace(self.manifest + '.tmp', self.manifest)
+
+        old_generation = self.generation
+        self.files = files_
+        self._open(generation)
+        if old_generation is not None:
+            shutil.rmtree(os.path.join(self.directory, old_generation), ignore_errors=True)
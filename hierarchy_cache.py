@@ -0,0 +1,112 @@
+"""
+On-disk cache for the mesh hierarchy built by
+mesh_operations.generate_transform_matrices.
+
+Each level is stored in its own file, keyed by the template file hash and by
+the downsampling factors leading to that level, so that changing the last
+factors only recomputes the levels that actually changed.
+
+Prebuild the cache with:
+    python hierarchy_cache.py -c files/default.cfg
+"""
+import argparse
+from config_parser import read_config
+import hashlib
+import mesh_operations
+import numpy as np
+import os
+from psbody.mesh import Mesh
+import scipy.sparse as sp
+import time
+
+# bump this whenever the content of the cached levels changes
+CACHE_VERSION = 1
+
+def file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def cache_directory(config, template_file):
+    return os.path.join(config['cache_dir'], 'hierarchy', 'v' + str(CACHE_VERSION), file_hash(template_file)[:16])
+
+def level_path(directory, factors):
+    return os.path.join(directory, 'level_' + '_'.join(str(f) for f in factors) + '.npz')
+
+def _sparse_to_dict(prefix, matrix):
+    matrix = matrix.tocoo()
+    return {prefix + '_data': matrix.data, prefix + '_row': matrix.row,
+            prefix + '_col': matrix.col, prefix + '_shape': np.array(matrix.shape)}
+
+def _dict_to_sparse(prefix, d):
+    shape = tuple(d[prefix + '_shape'])
+    return sp.coo_matrix((d[prefix + '_data'], (d[prefix + '_row'], d[prefix + '_col'])), shape=shape)
+
+def save_level(path, mesh, A, D, U):
+    arrays = {'v': mesh.v, 'f': mesh.f}
+    arrays.update(_sparse_to_dict('A', A))
+    arrays.update(_sparse_to_dict('D', D))
+    arrays.update(_sparse_to_dict('U', U))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so that concurrent runs never read a partial level
+    tmp = path + '.' + str(os.getpid()) + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+def load_level(path):
+    with np.load(path) as d:
+        mesh = Mesh(v=d['v'], f=d['f'])
+        return mesh, _dict_to_sparse('A', d), _dict_to_sparse('D', d), _dict_to_sparse('U', d)
+
+def generate_transform_matrices(config, mesh, template_file=None, verbose=True):
+    """Cached version of mesh_operations.generate_transform_matrices.
+
+    Levels already present in the cache are loaded, missing ones are
+    computed from the previous level and saved.
+    Returns M, A, D, U in the same format as the uncached function.
+    """
+    factors = list(config['downsampling_factors'])
+    if template_file is None: template_file = config['template']
+    directory = cache_directory(config, template_file)
+
+    M, A, D, U = [], [], [], []
+    A.append(mesh_operations.get_vert_connectivity(mesh.v, mesh.f).tocoo())
+    M.append(mesh)
+
+    for i, factor in enumerate(factors):
+        path = level_path(directory, factors[:i + 1])
+        if os.path.exists(path):
+            new_mesh, new_A, new_D, new_U = load_level(path)
+        else:
+            begin = time.time()
+            new_mesh, new_A, new_D, new_U = mesh_operations.downsample_level(M[-1], factor)
+            save_level(path, new_mesh, new_A, new_D, new_U)
+            if verbose: print('hierarchy level {} computed in {:.2f}s, saved to {}'.format(i + 1, time.time() - begin, path))
+        M.append(new_mesh)
+        A.append(new_A)
+        D.append(new_D)
+        U.append(new_U)
+
+    return M, A, D, U
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prebuild the mesh hierarchy cache', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c', '--conf', help='path of config file', default=os.path.join(os.path.dirname(__file__), 'files/default.cfg'))
+    parser.add_argument('-t', '--template', help='template mesh, overrides the config file')
+    parser.add_argument('-f', '--factors', help='comma separated downsampling factors, overrides the config file')
+    parser.add_argument('-d', '--cache_dir', help='cache directory, overrides the config file')
+    args = parser.parse_args()
+
+    config = read_config(args.conf)
+    if args.template: config['template'] = args.template
+    if args.factors: config['downsampling_factors'] = [int(x) for x in args.factors.split(',')]
+    if args.cache_dir: config['cache_dir'] = args.cache_dir
+
+    begin = time.time()
+    template_mesh = Mesh(filename=config['template'])
+    M, A, D, U = generate_transform_matrices(config, template_mesh)
+    print('hierarchy for', config['template'], 'with factors', config['downsampling_factors'], 'ready in {:.2f}s'.format(time.time() - begin))
+    print('number of vertices per level:', [len(m.v) for m in M])
+    print('cache directory:', cache_directory(config, config['template']))
@@ -1,6 +1,6 @@
 import argparse
 from config_parser import read_config
-from data import MeshData, listMeshes, save_obj
+from data import get_dataset, get_loader, listMeshes, save_obj
 import json
 from model import get_model, classifier_
 import numpy as np
@@ -28,7 +28,7 @@ def inference(loader, net, output_path, mean, std, config, faces, args):
         for data in d:
             x,x_gt, y, f, gt_mesh , R,m,s = data
             x, x_gt = x.to(device), x_gt.to(device)
-            local_batch_size = x.num_graphs
+            local_batch_size = x_gt.shape[0]
             x_gt = x_gt.reshape(local_batch_size, -1, 3).float()
             pred = classifier_(net, x_gt)
 
@@ -95,6 +95,7 @@ def main(args):
     batch_size = config['batch_size']
     print( 'loading template...', config[ 'template' ] )
     net, template_mesh = get_model( config, device )
+    if args.compile : net.compile_static( args.compile )
     template = np.array( template_mesh.v )
     faces = np.array( template_mesh.f )
     norm_dict = np.load(os.path.join(checkpoint_dir, 'norm.npz'), allow_pickle = True)
@@ -105,8 +106,8 @@ def main(args):
     else : models = [ args.model ]
 
     dataset_index, labels = listMeshes( config, False )
-    dataset = MeshData(dataset_index, config, labels, dtype = 'test', template = template, pre_transform = Normalize())
-    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+    dataset = get_dataset(dataset_index, config, labels, dtype = 'test', template = template, pre_transform = Normalize())
+    loader = get_loader(dataset, config, batch_size, shuffle=False)
 
     for i in models:
         checkpoint_file = os.path.join( checkpoint_dir, 'checkpoint_'+ str(i)+'.pt' )
@@ -126,6 +127,7 @@ if __name__ == '__main__':
     parser.add_argument('-m', '--meshes',action='store_true', help = "save meshes")
     parser.add_argument('-a', '--all',action='store_true', help = "inference for all folds")
     parser.add_argument('-n', '--model',type = int, default= 1)
+    parser.add_argument('--compile', nargs='?', const='compile', choices=['compile', 'script'], help = "use the compiled static encoder and decoder of cheb_VAE (torch.compile or TorchScript)")
     args = parser.parse_args()
 
     if args.conf is None:
@@ -0,0 +1,161 @@
+"""
+Per level choice of the kernels of cheb_VAE (conv_kernel = auto).
+
+For each level of the mesh hierarchy, the Chebyshev convolution and the
+pooling layers are timed (forward + backward, at the training batch size)
+with message passing (scatter), CSR products (spmm) and dense products
+(dense, for the small levels only), and the fastest kernel is kept.
+The choices are saved in cache_dir, keyed by the hierarchy, the layer sizes
+and the machine, so that later runs skip the timing.
+
+Run the tuning with:
+    python kernel_autotune.py -c files/default.cfg
+"""
+import argparse
+from config_parser import read_config
+import hashlib
+import json
+from nn.conv import ChebConv_batch
+from nn.pool import SurfacePool
+from nn.sparse import laplacian_operator, pool_operator
+import os
+import time
+import torch
+
+# bump this whenever the timed kernels change
+# (v2: CUDA timings wait for the kernels to finish)
+CACHE_VERSION = 2
+
+KERNELS = ['scatter', 'spmm', 'dense']
+
+# dense operators are only tried up to this number of matrix entries
+DENSE_MAX_ENTRIES = 1 << 22
+
+def cache_path(config, key):
+    return os.path.join(config['cache_dir'], 'kernels', 'v' + str(CACHE_VERSION), key + '.json')
+
+def tuning_key(config, num_nodes, A_edge_index, D_t, device):
+    """Hash of everything the timings depend on."""
+    device = torch.device(device)
+    machine = torch.cuda.get_device_name(device) if device.type == 'cuda' else 'cpu{}'.format(torch.get_num_threads())
+    description = {'num_nodes': list(num_nodes),
+                   'edges': [int(e.size(1)) for e in A_edge_index],
+                   'pool_entries': [int(d._nnz()) for d in D_t],
+                   'filters': list(config['num_conv_filters']),
+                   'K': list(config['polygon_order']),
+                   'batch_size': config['batch_size'],
+                   'node_major': bool(config.get('node_major', False)),
+                   'fused': bool(config.get('fused_chebyshev', False)),
+                   'recompute': bool(config.get('recompute_chebyshev', False)),
+                   'vertex_order': config.get('vertex_order', 'original'),
+                   'machine': machine, 'torch': torch.__version__}
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
+
+def best_time(function, repeat):
+    """function must wait for its device kernels to finish."""
+    function()  # warm up
+    best = None
+    for i in range(repeat):
+        begin = time.time()
+        function()
+        duration = time.time() - begin
+        if best is None or duration < best: best = duration
+    return best
+
+def fastest(name, candidates, make_function, repeat, verbose):
+    """Times make_function(kernel)() for each candidate kernel and returns
+    the fastest one."""
+    times = {kernel: best_time(make_function(kernel), repeat) for kernel in candidates}
+    kernel = min(times, key=times.get)
+    if verbose: print('{:24s}'.format(name), ', '.join('{} {:.2f}ms'.format(k, 1000 * t) for k, t in times.items()), '->', kernel)
+    return kernel
+
+def training_step(layer, x):
+    def run():
+        x.grad = None
+        out = layer(x)
+        out.backward(torch.ones_like(out))
+        if x.device.type == 'cuda': torch.cuda.synchronize(x.device)
+    return run
+
+def tune_kernels(config, num_nodes, A_edge_index, A_norm, D_t, U_t, device, repeat=3, verbose=True):
+    """Returns the kernels of the laplacians, last_laplacian, down and up
+    operators of cheb_VAE, as expected by its kernels argument."""
+    node_major = config.get('node_major', False)
+    batch_size = config['batch_size']
+    filters = list(config['num_conv_filters'])
+    K = config['polygon_order'][0]
+    pool = SurfacePool()
+
+    def features(level):
+        return filters[min(level, len(filters) - 1)]
+
+    def batch(num, F):
+        shape = (num, batch_size, F) if node_major else (batch_size, num, F)
+        return torch.randn(shape, device=device, requires_grad=True)
+
+    def candidates(size):
+        return [k for k in KERNELS if k != 'dense' or size[0] * size[1] <= DENSE_MAX_ENTRIES]
+
+    def conv_function(edge_index, norm, num, F):
+        conv = ChebConv_batch(F, F, K, fused=config.get('fused_chebyshev', False),
+                              recompute=config.get('recompute_chebyshev', False)).to(device)
+        x = batch(num, F)
+        def make(kernel):
+            operator = laplacian_operator(kernel, edge_index, norm, num)
+            return training_step(lambda x: conv(x, edge_index, norm, operator=operator, node_major=node_major), x)
+        return make
+
+    def pool_function(matrix, F):
+        x = batch(matrix.size(1), F)
+        def make(kernel):
+            operator = pool_operator(kernel, matrix)
+            return training_step(lambda x: pool(x, operator, node_major=node_major), x)
+        return make
+
+    kernels = {'laplacian': [], 'down': [], 'up': []}
+    for level, num in enumerate(num_nodes):
+        kernels['laplacian'].append(fastest('laplacian {} ({})'.format(level, num), candidates((num, num)),
+                                            conv_function(A_edge_index[level], A_norm[level], num, features(level)), repeat, verbose))
+    kernels['last_laplacian'] = fastest('last laplacian ({})'.format(num_nodes[0]), candidates((num_nodes[0], num_nodes[0])),
+                                        conv_function(A_edge_index[-1], A_norm[-1], num_nodes[0], filters[0]), repeat, verbose)
+    for level, (down, up) in enumerate(zip(D_t, U_t)):
+        kernels['down'].append(fastest('down {} ({} -> {})'.format(level, down.size(1), down.size(0)), candidates(down.size()),
+                                       pool_function(down, features(level)), repeat, verbose))
+        kernels['up'].append(fastest('up {} ({} -> {})'.format(level, up.size(1), up.size(0)), candidates(up.size()),
+                                     pool_function(up, features(level + 1)), repeat, verbose))
+    return kernels
+
+def get_kernels(config, num_nodes, A_edge_index, A_norm, D_t, U_t, device):
+    """Cached version of tune_kernels."""
+    path = cache_path(config, tuning_key(config, num_nodes, A_edge_index, D_t, device))
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+
+    begin = time.time()
+    # the timings must not change the random state used to initialize the model
+    device = torch.device(device)
+    with torch.random.fork_rng(devices=[device] if device.type == 'cuda' else []):
+        kernels = tune_kernels(config, num_nodes, A_edge_index, A_norm, D_t, U_t, device)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.' + str(os.getpid()) + '.tmp', 'w') as f:
+        json.dump(kernels, f)
+    os.replace(path + '.' + str(os.getpid()) + '.tmp', path)
+    print('kernels tuned in {:.2f}s, saved to {}'.format(time.time() - begin, path))
+    return kernels
+
+if __name__ == '__main__':
+    import model
+
+    parser = argparse.ArgumentParser(description='Choose the kernels of cheb_VAE for each level', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c', '--conf', help='path of config file', default=os.path.join(os.path.dirname(__file__), 'files/default.cfg'))
+    parser.add_argument('-d', '--cache_dir', help='cache directory, overrides the config file')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    config = read_config(args.conf)
+    if args.cache_dir: config['cache_dir'] = args.cache_dir
+    config['conv_kernel'] = 'auto'
+    net, template = model.get_model(config, args.device, model_type='cheb_VAE', save_init=False)
+    print('kernels:', net.kernels)
@@ -9,7 +9,7 @@ main function
 """
 import argparse
 from config_parser import read_config
-from data import MeshData, listMeshes, save_obj
+from data import get_dataset, get_loader, get_registry, listMeshes, save_obj
 import json
 from model import get_model, classifier_, save_model
 import numpy as np
@@ -20,7 +20,6 @@ import time
 import torch
 import torch.nn.functional as F
 import torch_geometric
-from torch_geometric.loader import DataLoader
 from transform import Normalize
 from utils import *
 
@@ -42,7 +41,7 @@ def train(model, train_loader, optimizer, device, checkpoint_dir):
         x,x_gt, y, filename, gt_mesh , R,m,s = data
         x, x_gt = x.to(device), x_gt.to(device)
         sex_hot = F.one_hot(y, num_classes = 2).to(device)
-        batch_size = x.num_graphs
+        batch_size = x_gt.shape[0]
         total += batch_size
 
         optimizer.zero_grad()
@@ -100,7 +99,7 @@ def evaluate(n, model, test_loader, device, faces = None, checkpoint_dir = None,
             x, x_gt = x.to(device), x_gt.to(device)
             sex_hot = F.one_hot(y, num_classes = 2).to(device)
             loss, correct, out, z, y_hat = model(x, x_gt, sex_hot, m_type = "test")
-            batch_size = x.num_graphs
+            batch_size = x_gt.shape[0]
             total += batch_size
 
             kld = z[0].mean()
@@ -214,23 +213,27 @@ def main(args):
 
     n = 0
     y = np.ones(len(dataset_index))
+    registry = None
 
     for train_index, test_index in skf.split(dataset_index, y):
         train_, valid_index = train_test_split(np.array(dataset_index)[train_index], test_size=test_size, random_state = random_seeds)
         history = []
         print('loading template...', config['template'])
         net, template_mesh = get_model(config, device)
+        if args.compile: net.compile_static(args.compile)
         template = np.array(template_mesh.v)
         faces = np.array(template_mesh.f)
         optimizer = torch.optim.Adam(net.parameters(), lr=lr, weight_decay=weight_decay)
         n+=1
+        # meshes are loaded once, each fold only selects its rows
+        if registry is None: registry = get_registry(dataset_index, config, labels, template, fit_alignment = args.train)
 
         if args.train:
-            train_dataset = MeshData(train_, config, labels, dtype = 'train', template = template, pre_transform = Normalize())
-            train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
+            train_dataset = get_dataset(train_, config, labels, dtype = 'train', template = template, pre_transform = Normalize(), registry = registry)
+            train_loader = get_loader(train_dataset, config, batch_size, shuffle=True)
 
-            valid_dataset = MeshData(valid_index, config, labels, dtype = 'test', template = template, pre_transform = Normalize())
-            valid_loader = DataLoader(valid_dataset, batch_size=batch_size, shuffle=True)
+            valid_dataset = get_dataset(valid_index, config, labels, dtype = 'test', template = template, pre_transform = Normalize(), registry = registry)
+            valid_loader = get_loader(valid_dataset, config, batch_size, shuffle=True)
             best_loss = 10000000
             best_sex_change_success_rate = -1
 
@@ -296,8 +299,8 @@ def main(args):
         else : history.append( {} )
 
         if args.test:
-            test_dataset = MeshData(np.array(dataset_index)[test_index], config, labels, dtype = 'test', template = template, pre_transform = Normalize())
-            test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
+            test_dataset = get_dataset(np.array(dataset_index)[test_index], config, labels, dtype = 'test', template = template, pre_transform = Normalize(), registry = registry)
+            test_loader = get_loader(test_dataset, config, batch_size, shuffle=False)
             checkpoint_file = os.path.join(checkpoint_dir, 'checkpoint_'+ str(n)+'.pt')
             checkpoint = torch.load(checkpoint_file)
             net.load_state_dict(checkpoint['state_dict'])
@@ -332,6 +335,7 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--test',action='store_true')
     parser.add_argument('--cpu',action='store_true', help = "force cpu")
     parser.add_argument('-v', '--vis',action='store_true', help = "save transformed meshes")
+    parser.add_argument('--compile', nargs='?', const='compile', choices=['compile', 'script'], help = "use the compiled static encoder and decoder of cheb_VAE (torch.compile or TorchScript)")
     args = parser.parse_args()
 
     if args.conf is None:
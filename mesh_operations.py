@@ -3,6 +3,7 @@ import heapq
 import numpy as np
 import scipy.sparse as sp
 from psbody.mesh import Mesh
+from topology import get_topology, get_vert_connectivity
 
 def row(A):
     return A.reshape((1, -1))
@@ -10,36 +11,12 @@ def row(A):
 def col(A):
     return A.reshape((-1, 1))
 
-def get_vert_connectivity(mesh_v, mesh_f):
-    """Returns a sparse matrix (of size #verts x #verts) where each nonzero
-    element indicates a neighborhood relation. For example, if there is a
-    nonzero element in position (15,12), that means vertex 15 is connected
-    by an edge to vertex 12."""
-
-    vpv = sp.csc_matrix((len(mesh_v),len(mesh_v)))
-
-    # for each column in the faces...
-    for i in range(3):
-        IS = mesh_f[:,i]
-        JS = mesh_f[:,(i+1)%3]
-        data = np.ones(len(IS))
-        ij = np.vstack((row(IS.flatten()), row(JS.flatten())))
-        mtx = sp.csc_matrix((data, ij), shape=vpv.shape)
-        vpv = vpv + mtx + mtx.T
-
-    return vpv
-
 def get_vertices_per_edge(mesh_v, mesh_f):
     """Returns an Ex2 array of adjacencies between vertices, where
     each element in the array is a vertex index. Each edge is included
-    only once. If output of get_faces_per_edge is provided, this is used to
-    avoid call to get_vert_connectivity()"""
-
-    vc = sp.coo_matrix(get_vert_connectivity(mesh_v, mesh_f))
-    result = np.hstack((col(vc.row), col(vc.col)))
-    result = result[result[:,0] < result[:,1]] # for uniqueness
+    only once."""
 
-    return result
+    return get_topology(mesh_f, len(mesh_v)).edges
 
 
 def vertex_quadrics(mesh):
@@ -49,23 +26,30 @@ def vertex_quadrics(mesh):
        v_quadrics: an (N x 4 x 4) array, where N is # vertices.
     """
 
-    # Allocate quadrics
-    v_quadrics = np.zeros((len(mesh.v), 4, 4,))
-
-    # For each face...
-    for f_idx in range(len(mesh.f)):
-
-        # Compute normalized plane equation for that face
-        vert_idxs = mesh.f[f_idx]
-        verts = np.hstack((mesh.v[vert_idxs], np.array([1, 1, 1]).reshape(-1, 1)))
-        u, s, v = np.linalg.svd(verts)
-        eq = v[-1, :].reshape(-1, 1)
-        eq = eq / (np.linalg.norm(eq[0:3]))
-
-        # Add the outer product of the plane equation to the
-        # quadrics of the vertices for this face
-        for k in range(3):
-            v_quadrics[mesh.f[f_idx, k], :, :] += np.outer(eq, eq)
+    faces = np.asarray(mesh.f, dtype=np.int64)
+    verts = mesh.v[faces]
+
+    # Compute normalized plane equations for all faces at once
+    normals = np.cross(verts[:, 1] - verts[:, 0], verts[:, 2] - verts[:, 0])
+    norms = np.linalg.norm(normals, axis=1)
+    degenerate = norms == 0
+    eqs = np.empty((len(faces), 4))
+    eqs[:, :3] = normals / np.where(degenerate, 1, norms)[:, None]
+    eqs[:, 3] = -np.einsum('ij,ij->i', eqs[:, :3], verts[:, 0])
+
+    # Degenerate faces have no normal, fall back to the null space of the
+    # homogeneous vertex coordinates as in the per-face formulation
+    if np.any(degenerate):
+        homogeneous = np.concatenate((verts[degenerate], np.ones((np.count_nonzero(degenerate), 3, 1))), axis=2)
+        eq = np.linalg.svd(homogeneous)[2][:, -1, :]
+        eqs[degenerate] = eq / np.linalg.norm(eq[:, :3], axis=1, keepdims=True)
+
+    # Add the outer product of the plane equation to the
+    # quadrics of the vertices of each face
+    outer = (eqs[:, :, None] * eqs[:, None, :]).reshape(-1, 16)
+    incidence = sp.csr_matrix((np.ones(faces.size), (faces.ravel(), np.repeat(np.arange(len(faces)), 3))),
+                              shape=(len(mesh.v), len(faces)))
+    v_quadrics = incidence.dot(outer).reshape(-1, 4, 4)
 
     return v_quadrics
 
@@ -84,10 +68,21 @@ def _get_sparse_transform(faces, num_original_verts):
 
     return (new_faces, mtx)
 
+def _collapse_costs(Qsum, v):
+    """Returns p^T Qsum p for homogeneous points p = (v, 1).
+
+    Only elementwise operations are used so that the result does not depend
+    on how many costs are evaluated at once."""
+    Qp = Qsum[..., :, 0] * v[..., None, 0] + Qsum[..., :, 1] * v[..., None, 1] \
+        + Qsum[..., :, 2] * v[..., None, 2] + Qsum[..., :, 3]
+    return Qp[..., 0] * v[..., 0] + Qp[..., 1] * v[..., 1] + Qp[..., 2] * v[..., 2] + Qp[..., 3]
+
 def qslim_decimator_transformer(mesh, factor=None, n_verts_desired=None):
     """Return a simplified version of this mesh.
 
-    A Qslim-style approach is used here.
+    A Qslim-style approach is used here. The queue entries are indexed by
+    vertex and the faces are updated incrementally, so that each collapse only
+    touches the neighbourhood of the collapsed edge.
 
     :param factor: fraction of the original vertices to retain
     :param n_verts_desired: number of the original vertices to retain
@@ -100,153 +95,178 @@ def qslim_decimator_transformer(mesh, factor=None, n_verts_desired=None):
     if n_verts_desired is None:
         n_verts_desired = math.ceil(len(mesh.v) * factor)
 
+    num_verts = len(mesh.v)
     Qv = vertex_quadrics(mesh)
 
-    # fill out a sparse matrix indicating vertex-vertex adjacency
-    # from psbody.mesh.topology.connectivity import get_vertices_per_edge
-    vert_adj = get_vertices_per_edge(mesh.v, mesh.f)
-    # vert_adj = sp.lil_matrix((len(mesh.v), len(mesh.v)))
-    # for f_idx in range(len(mesh.f)):
-    #     vert_adj[mesh.f[f_idx], mesh.f[f_idx]] = 1
-
-    vert_adj = sp.csc_matrix((vert_adj[:, 0] * 0 + 1, (vert_adj[:, 0], vert_adj[:, 1])), shape=(len(mesh.v), len(mesh.v)))
-    vert_adj = vert_adj + vert_adj.T
-    vert_adj = vert_adj.tocoo()
-
-    def collapse_cost(Qv, r, c, v):
-        Qsum = Qv[r, :, :] + Qv[c, :, :]
-        p1 = np.vstack((v[r].reshape(-1, 1), np.array([1]).reshape(-1, 1)))
-        p2 = np.vstack((v[c].reshape(-1, 1), np.array([1]).reshape(-1, 1)))
-
-        destroy_c_cost = p1.T.dot(Qsum).dot(p1)
-        destroy_r_cost = p2.T.dot(Qsum).dot(p2)
-        result = {
-            'destroy_c_cost': destroy_c_cost,
-            'destroy_r_cost': destroy_r_cost,
-            'collapse_cost': min([destroy_c_cost, destroy_r_cost]),
-            'Qsum': Qsum}
-        return result
-
-    # construct a queue of edges with costs
-    queue = []
-    for k in range(vert_adj.nnz):
-        r = vert_adj.row[k]
-        c = vert_adj.col[k]
+    vert_adj = get_topology(mesh.f, num_verts).coo
+    keep = vert_adj.row <= vert_adj.col
+    rows, cols = vert_adj.row[keep], vert_adj.col[keep]
 
-        if r > c:
-            continue
+    Qsum = Qv[rows] + Qv[cols]
+    costs = np.minimum(_collapse_costs(Qsum, mesh.v[cols]), _collapse_costs(Qsum, mesh.v[rows]))
 
-        cost = collapse_cost(Qv, r, c, mesh.v)['collapse_cost']
-        heapq.heappush(queue, (cost, (r, c)))
+    # queue entries are mutable [cost, r, c, id] lists so that renaming a
+    # vertex updates the entry in place, keeping its position in the heap
+    queue = []
+    vert_entries = [set() for _ in range(num_verts)]
+    entries = {}
+    for k, (cost, r, c) in enumerate(zip(costs.tolist(), rows.tolist(), cols.tolist())):
+        entry = [cost, r, c, k]
+        entries[k] = entry
+        vert_entries[r].add(k)
+        vert_entries[c].add(k)
+        heapq.heappush(queue, entry)
+
+    def forget(entry):
+        vert_entries[entry[1]].discard(entry[3])
+        vert_entries[entry[2]].discard(entry[3])
+        del entries[entry[3]]
+
+    # incremental face bookkeeping
+    faces = mesh.f.astype(np.int64)
+    face_alive = np.ones(len(faces), dtype=bool)
+    vert_faces = [[] for _ in range(num_verts)]
+    for f_idx, face in enumerate(faces.tolist()):
+        for vert in face:
+            vert_faces[vert].append(f_idx)
+    vert_num_faces = np.array([len(f) for f in vert_faces])
+    nverts_total = int(np.count_nonzero(vert_num_faces))
+
+    def remove_face_from(vert):
+        vert_num_faces[vert] -= 1
+        return 1 if vert_num_faces[vert] == 0 else 0
 
-    # decimate
-    collapse_list = []
-    nverts_total = len(mesh.v)
-    faces = mesh.f.copy()
     while nverts_total > n_verts_desired:
         e = heapq.heappop(queue)
-        r = e[1][0]
-        c = e[1][1]
+        r = e[1]
+        c = e[2]
         if r == c:
+            forget(e)
             continue
 
-        cost = collapse_cost(Qv, r, c, mesh.v)
-        if cost['collapse_cost'] > e[0]:
-            heapq.heappush(queue, (cost['collapse_cost'], e[1]))
-            # print 'found outdated cost, %.2f < %.2f' % (e[0], cost['collapse_cost'])
+        Qsum = Qv[r] + Qv[c]
+        destroy_c_cost, destroy_r_cost = _collapse_costs(Qsum, mesh.v[[r, c]]).tolist()
+        cost = min(destroy_c_cost, destroy_r_cost)
+        if cost > e[0]:
+            e[0] = cost
+            heapq.heappush(queue, e)
             continue
-        else:
 
-            # update old vert idxs to new one,
-            # in queue and in face list
-            if cost['destroy_c_cost'] < cost['destroy_r_cost']:
-                to_destroy = c
-                to_keep = r
+        forget(e)
+        if destroy_c_cost < destroy_r_cost:
+            to_destroy = c
+            to_keep = r
+        else:
+            to_destroy = r
+            to_keep = c
+
+        # rename to_destroy into to_keep in the queue
+        for k in vert_entries[to_destroy]:
+            entry = entries[k]
+            if entry[1] == to_destroy: entry[1] = to_keep
+            if entry[2] == to_destroy: entry[2] = to_keep
+            vert_entries[to_keep].add(k)
+        vert_entries[to_destroy] = set()
+
+        Qv[r] = Qsum
+        Qv[c] = Qsum
+
+        # same in the faces, removing the ones that become degenerate
+        for f_idx in vert_faces[to_destroy]:
+            if not face_alive[f_idx]: continue
+            face = faces[f_idx]
+            if to_keep in face:
+                face_alive[f_idx] = False
+                for vert in face:
+                    nverts_total -= remove_face_from(vert)
+                face[face == to_destroy] = to_keep
             else:
-                to_destroy = r
-                to_keep = c
-
-            collapse_list.append([to_keep, to_destroy])
-
-            # in our face array, replace "to_destroy" vertidx with "to_keep" vertidx
-            np.place(faces, faces == to_destroy, to_keep)
-
-            # same for queue
-            which1 = [idx for idx in range(len(queue)) if queue[idx][1][0] == to_destroy]
-            which2 = [idx for idx in range(len(queue)) if queue[idx][1][1] == to_destroy]
-            for k in which1:
-                queue[k] = (queue[k][0], (to_keep, queue[k][1][1]))
-            for k in which2:
-                queue[k] = (queue[k][0], (queue[k][1][0], to_keep))
-
-            Qv[r, :, :] = cost['Qsum']
-            Qv[c, :, :] = cost['Qsum']
-
-            a = faces[:, 0] == faces[:, 1]
-            b = faces[:, 1] == faces[:, 2]
-            c = faces[:, 2] == faces[:, 0]
-
-            # remove degenerate faces
-            def logical_or3(x, y, z):
-                return np.logical_or(x, np.logical_or(y, z))
-
-            faces_to_keep = np.logical_not(logical_or3(a, b, c))
-            faces = faces[faces_to_keep, :].copy()
-
-        nverts_total = (len(np.unique(faces.flatten())))
-
-    new_faces, mtx = _get_sparse_transform(faces, len(mesh.v))
+                face[face == to_destroy] = to_keep
+                nverts_total -= remove_face_from(to_destroy)
+                if vert_num_faces[to_keep] == 0: nverts_total += 1
+                vert_num_faces[to_keep] += 1
+                vert_faces[to_keep].append(f_idx)
+        vert_faces[to_destroy] = []
+
+    new_faces, mtx = _get_sparse_transform(faces[face_alive], num_verts)
     return new_faces, mtx
 
+def _lstsq_rows(A, b):
+    """Per-row least squares, used for the few ill-conditioned systems."""
+    return np.array([np.linalg.lstsq(A[i], b[i], rcond=None)[0] for i in range(len(A))]).reshape(len(A), A.shape[2])
+
+def _triangle_coefficients(v0, v1, v2, p, eps=1e-12):
+    """Solves [v0 v1 v2] c = p for a batch of triangles with Cramer's rule.
+
+    The system is solved in the (v0, v1 - v0, v2 - v0) basis, which is much
+    better conditioned for small triangles far from the origin."""
+    e1 = v1 - v0
+    e2 = v2 - v0
+    n = np.cross(e1, e2)
+    det = np.einsum('ij,ij->i', v0, n)
+    scale = np.linalg.norm(v0, axis=1) * np.linalg.norm(e1, axis=1) * np.linalg.norm(e2, axis=1)
+    singular = ~(np.abs(det) > eps * scale)
+    det = np.where(singular, 1, det)
+    total = np.einsum('ij,ij->i', p, n) / det
+    c1 = np.einsum('ij,ij->i', v0, np.cross(p, e2)) / det
+    c2 = np.einsum('ij,ij->i', v0, np.cross(e1, p)) / det
+    coeffs = np.stack((total - c1 - c2, c1, c2), axis=1)
+    if np.any(singular):
+        A = np.stack((v0[singular], v1[singular], v2[singular]), axis=2)
+        coeffs[singular] = _lstsq_rows(A, p[singular])
+    return coeffs
+
+def _edge_coefficients(v0, v1, p, eps=1e-12):
+    """Least squares solution of [v0 v1] c = p for a batch of edges, using the
+    2x2 normal equations in the better conditioned (v0, v1 - v0) basis."""
+    e = v1 - v0
+    a00 = np.einsum('ij,ij->i', v0, v0)
+    a01 = np.einsum('ij,ij->i', v0, e)
+    a11 = np.einsum('ij,ij->i', e, e)
+    b0 = np.einsum('ij,ij->i', v0, p)
+    b1 = np.einsum('ij,ij->i', e, p)
+    det = a00 * a11 - a01 * a01
+    singular = ~(det > eps * a00 * a11)
+    det = np.where(singular, 1, det)
+    total = (a11 * b0 - a01 * b1) / det
+    c1 = (a00 * b1 - a01 * b0) / det
+    coeffs = np.stack((total - c1, c1), axis=1)
+    if np.any(singular):
+        A = np.stack((v0[singular], v1[singular]), axis=2)
+        coeffs[singular] = _lstsq_rows(A, p[singular])
+    return coeffs
 
 def setup_deformation_transfer(source, target, use_normals=False):
-    rows = np.zeros(3 * target.v.shape[0])
-    cols = np.zeros(3 * target.v.shape[0])
-    coeffs_v = np.zeros(3 * target.v.shape[0])
-    coeffs_n = np.zeros(3 * target.v.shape[0])
+    num_target = target.v.shape[0]
 
     nearest_faces, nearest_parts, nearest_vertices = source.compute_aabb_tree().nearest(target.v, True)
     nearest_faces = nearest_faces.ravel().astype(np.int64)
     nearest_parts = nearest_parts.ravel().astype(np.int64)
-    nearest_vertices = nearest_vertices.ravel()
-
-    for i in range(target.v.shape[0]):
-        # Closest triangle index
-        f_id = nearest_faces[i]
-        # Closest triangle vertex ids
-        nearest_f = source.f[f_id]
-
-        # Closest surface point
-        nearest_v = nearest_vertices[3 * i:3 * i + 3]
-        # Distance vector to the closest surface point
-        dist_vec = target.v[i] - nearest_v
-
-        rows[3 * i:3 * i + 3] = i * np.ones(3)
-        cols[3 * i:3 * i + 3] = nearest_f
-
-        n_id = nearest_parts[i]
-        if n_id == 0:
-            # Closest surface point in triangle
-            A = np.vstack((source.v[nearest_f])).T
-            coeffs_v[3 * i:3 * i + 3] = np.linalg.lstsq(A, nearest_v, rcond=None)[0]
-        elif n_id > 0 and n_id <= 3:
-            # Closest surface point on edge
-            A = np.vstack((source.v[nearest_f[n_id - 1]], source.v[nearest_f[n_id % 3]])).T
-            tmp_coeffs = np.linalg.lstsq(A, target.v[i], rcond=None)[0]
-            coeffs_v[3 * i + n_id - 1] = tmp_coeffs[0]
-            coeffs_v[3 * i + n_id % 3] = tmp_coeffs[1]
-        else:
-            # Closest surface point a vertex
-            coeffs_v[3 * i + n_id - 4] = 1.0
-
-    #    if use_normals:
-    #        A = np.vstack((vn[nearest_f])).T
-    #        coeffs_n[3 * i:3 * i + 3] = np.linalg.lstsq(A, dist_vec)[0]
-
-    #coeffs = np.hstack((coeffs_v, coeffs_n))
-    #rows = np.hstack((rows, rows))
-    #cols = np.hstack((cols, source.v.shape[0] + cols))
-    matrix = sp.csc_matrix((coeffs_v, (rows, cols)), shape=(target.v.shape[0], source.v.shape[0]))
+    nearest_vertices = nearest_vertices.reshape(-1, 3)
+
+    # Closest triangle vertex ids
+    nearest_f = source.f[nearest_faces].astype(np.int64)
+    rows = np.repeat(np.arange(num_target), 3)
+    cols = nearest_f.ravel()
+    coeffs_v = np.zeros((num_target, 3))
+
+    # Closest surface point in triangle
+    sel = nearest_parts == 0
+    tri = source.v[nearest_f[sel]]
+    coeffs_v[sel] = _triangle_coefficients(tri[:, 0], tri[:, 1], tri[:, 2], nearest_vertices[sel])
+
+    for n_id in range(1, 4):
+        # Closest surface point on edge
+        sel = np.flatnonzero(nearest_parts == n_id)
+        edge_coeffs = _edge_coefficients(source.v[nearest_f[sel, n_id - 1]], source.v[nearest_f[sel, n_id % 3]], target.v[sel])
+        coeffs_v[sel, n_id - 1] = edge_coeffs[:, 0]
+        coeffs_v[sel, n_id % 3] = edge_coeffs[:, 1]
+
+    for n_id in range(4, 7):
+        # Closest surface point a vertex
+        coeffs_v[nearest_parts == n_id, n_id - 4] = 1.0
+
+    matrix = sp.csc_matrix((coeffs_v.ravel(), (rows, cols)), shape=(num_target, source.v.shape[0]))
     return matrix
 
 
@@ -261,18 +281,34 @@ def generate_transform_matrices(mesh, factors):
        U: Upsampling transforms between each of the meshes
     """
 
-    factors = map(lambda x: 1.0 / x, factors)
     M, A, D, U = [], [], [], []
     A.append(get_vert_connectivity(mesh.v, mesh.f).tocoo())
     M.append(mesh)
 
     for i,factor in enumerate(factors):
-        ds_f, ds_D = qslim_decimator_transformer(M[-1], factor=factor)
-        D.append(ds_D.tocoo())
-        new_mesh_v = ds_D.dot(M[-1].v)
-        new_mesh = Mesh(v=new_mesh_v, f=ds_f)
+        new_mesh, new_A, new_D, new_U = downsample_level(M[-1], factor)
         M.append(new_mesh)
-        A.append(get_vert_connectivity(new_mesh.v, new_mesh.f).tocoo())
-        U.append(setup_deformation_transfer(M[-1], M[-2]).tocoo())
+        A.append(new_A)
+        D.append(new_D)
+        U.append(new_U)
 
     return M, A, D, U
+
+
+def downsample_level(mesh, factor):
+    """Decimates mesh by a downsampling factor and computes the transformations between mesh
+       and its decimated version.
+
+    Returns:
+       new_mesh: the decimated mesh
+       A: Adjacency matrix of new_mesh
+       D: Downsampling transform from mesh to new_mesh
+       U: Upsampling transform from new_mesh to mesh
+    """
+
+    ds_f, ds_D = qslim_decimator_transformer(mesh, factor=1.0 / factor)
+    new_mesh_v = ds_D.dot(mesh.v)
+    new_mesh = Mesh(v=new_mesh_v, f=ds_f)
+    A = get_vert_connectivity(new_mesh.v, new_mesh.f).tocoo()
+    U = setup_deformation_transfer(new_mesh, mesh).tocoo()
+    return new_mesh, A, ds_D.tocoo(), U
@@ -0,0 +1,112 @@
+"""
+Sharded on-disk storage of preprocessed meshes, for datasets which do not fit
+in memory.
+
+The raw vertices, aligned vertices and R/s/m Procrustes parameters of a list
+of files are stored in float32 blocks of block_size consecutive meshes. Blocks
+are loaded on demand and kept in a least recently used cache bounded by a
+byte budget, so that iterating over a dataset uses constant memory.
+"""
+from collections import OrderedDict
+from dataset_cache import ARRAYS, file_signature
+import hashlib
+import json
+import numpy as np
+import os
+import torch
+from torch.utils.data import Sampler
+
+# bump this whenever the content of the blocks changes
+CACHE_VERSION = 1
+
+def shard_directory(cache_dir, reference, files):
+    """Directory of the shards of files aligned on reference. The key depends
+    on the reference vertices and on the path, size and modification time of
+    each file, so that any change leads to new shards."""
+    h = hashlib.sha1(np.ascontiguousarray(reference, dtype=np.float64).tobytes())
+    for file in files:
+        h.update(json.dumps([os.path.abspath(file)] + file_signature(file)).encode())
+    return os.path.join(cache_dir, 'shards', 'v' + str(CACHE_VERSION), h.hexdigest()[:16])
+
+class MeshShards(object):
+    def __init__(self, directory, budget):
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'index.json')
+        self.budget = budget
+        self.blocks = OrderedDict()
+        self.size = 0
+        self.block_size = None
+        self.num_blocks = None
+        self.faces = None
+
+    def complete(self):
+        return os.path.exists(self.index_file)
+
+    def open(self):
+        with open(self.index_file) as f:
+            index = json.load(f)
+        self.block_size = index['block_size']
+        self.num_blocks = (len(index['files']) + self.block_size - 1) // self.block_size
+        self.faces = np.load(os.path.join(self.directory, 'faces.npy'))
+
+    def _block_path(self, block):
+        return os.path.join(self.directory, 'block_{:06d}.npz'.format(block))
+
+    def write_block(self, block, arrays):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._block_path(block) + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(tmp, **{k: np.ascontiguousarray(arrays[k], dtype=np.float32) for k in ARRAYS})
+        os.replace(tmp, self._block_path(block))
+
+    def finish(self, files, block_size, faces):
+        """Writes the index once all the blocks are written: shards without
+        an index are incomplete and rebuilt."""
+        np.save(os.path.join(self.directory, 'faces.npy'), faces)
+        with open(self.index_file + '.tmp', 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'block_size': block_size, 'files': [os.path.abspath(file) for file in files]}, f)
+        os.replace(self.index_file + '.tmp', self.index_file)
+        self.open()
+
+    def block(self, block):
+        """Arrays of a block, through the LRU cache."""
+        if block in self.blocks:
+            self.blocks.move_to_end(block)
+            return self.blocks[block]
+        with np.load(self._block_path(block)) as d:
+            arrays = {k: torch.from_numpy(d[k]) for k in ARRAYS}
+        self.blocks[block] = arrays
+        self.size += sum(a.numel() * a.element_size() for a in arrays.values())
+        # the block just loaded is always kept, even if it exceeds the budget alone
+        while self.size > self.budget and len(self.blocks) > 1:
+            evicted = self.blocks.popitem(last=False)[1]
+            self.size -= sum(a.numel() * a.element_size() for a in evicted.values())
+        return arrays
+
+    def get(self, rows):
+        """Tensors of raw, aligned, R, s and m for the given rows, in order."""
+        rows = torch.as_tensor(rows, dtype=torch.int64)
+        blocks = rows // self.block_size
+        out = None
+        for block in torch.unique(blocks).tolist():
+            selected = torch.nonzero(blocks == block).squeeze(1)
+            arrays = self.block(block)
+            if out is None:
+                out = {k: torch.empty((len(rows),) + a.shape[1:], dtype=a.dtype) for k, a in arrays.items()}
+            for k, a in arrays.items():
+                out[k][selected] = a[rows[selected] - block * self.block_size]
+        return out
+
+class BlockSampler(Sampler):
+    """Shuffles the blocks of the samples, then the samples inside each block,
+    so that an epoch loads each block once."""
+    def __init__(self, rows, block_size):
+        self.blocks = torch.as_tensor(rows, dtype=torch.int64) // block_size
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __iter__(self):
+        unique = torch.unique(self.blocks)
+        for block in unique[torch.randperm(len(unique))].tolist():
+            indices = torch.nonzero(self.blocks == block).squeeze(1)
+            yield from indices[torch.randperm(len(indices))].tolist()
@@ -13,8 +13,12 @@ from models.cheb_cls import cheb_GCN
 # # from models.Dynqmic_graph import DGCNN_cls
 from psbody.mesh import Mesh
 import torch
+import hierarchy_cache
+import kernel_autotune
 import mesh_operations
 import numpy as np
+import reorder
+from topology import get_mesh_topology
 from utils import *
 
 def save_model(coma, optimizer, epoch, train_loss, val_loss, checkpoint_dir):
@@ -46,20 +50,30 @@ def scipy_to_torch_sparse(scp_matrix):
 def get_model(config, device, model_type  = None, save_init = True):
     template_mesh = Mesh(filename=config['template'])
     num_feature = template_mesh.v.shape[1]
-    M, A, D, U = mesh_operations.generate_transform_matrices(template_mesh, config['downsampling_factors'])
+    M, A, D, U = hierarchy_cache.generate_transform_matrices(config, template_mesh)
+    M, A, D, U, permutations = reorder.reorder_hierarchy(M, A, D, U, config.get('vertex_order', 'original'))
+    permutation = None
+    if config.get('vertex_order', 'original') != 'original':
+        permutation = torch.from_numpy(permutations[0]).to(device)
 
     D_t = [scipy_to_torch_sparse(d).to(device) for d in D]
     U_t = [scipy_to_torch_sparse(u).to(device) for u in U]
     A_t = [scipy_to_torch_sparse(a).to(device) for a in A]
     num_nodes = [len(M[i].v) for i in range(len(M))]
+    topologies = [get_mesh_topology(m) for m in M]
 
     if model_type is None: model_type = config['type']
 
     print('Using model:', model_type)
     if model_type == 'cheb_VAE':
-        net = cheb_VAE(num_feature, config, D_t, U_t, A_t, num_nodes, model = config['model']).to(device)
+        kernels = None
+        if config.get('conv_kernel') == 'auto':
+            A_edge_index, A_norm = zip(*[t.to('cheb_norm', device) for t in topologies])
+            kernels = kernel_autotune.get_kernels(config, num_nodes, A_edge_index, A_norm, D_t, U_t, device)
+            print('kernels:', kernels)
+        net = cheb_VAE(num_feature, config, D_t, U_t, A_t, num_nodes, model = config['model'], topologies = topologies, kernels = kernels, permutation = permutation).to(device)
     elif model_type == 'cheb_GCN':
-        net = cheb_GCN(num_feature*2, config, D_t, U_t, A_t, num_nodes).to(device)
+        net = cheb_GCN(num_feature*2, config, D_t, U_t, A_t, num_nodes, topologies = topologies, permutation = permutation).to(device)
 
 #    for name,parameters in net.named_parameters():
 #        print(name,':',parameters.size())
@@ -11,6 +11,8 @@ import logpdf
 from math import sqrt
 from nn.pool import SurfacePool
 from nn.conv import ChebConv_batch
+from nn.sparse import laplacian_operator, pool_operator
+from models.static_VAE import StaticChebVAE
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -89,9 +91,14 @@ class AdaptiveInstanceNorm(nn.Module):
         return out
 
 
+def uniform_kernels(kernel, num_levels):
+    """The same kernel for all the operators of a hierarchy of num_levels levels."""
+    return {'laplacian': [kernel] * num_levels, 'last_laplacian': kernel,
+            'down': [kernel] * (num_levels - 1), 'up': [kernel] * (num_levels - 1)}
+
 class cheb_VAE(torch.nn.Module):
 
-    def __init__(self, num_features, config, downsample_matrices, upsample_matrices, adjacency_matrices, num_nodes, model = 'MSE_VAE'):
+    def __init__(self, num_features, config, downsample_matrices, upsample_matrices, adjacency_matrices, num_nodes, model = 'MSE_VAE', topologies = None, kernels = None, permutation = None):
         super(cheb_VAE, self).__init__()
         self.n_layers = config['n_layers']
         self.filters = list(config['num_conv_filters'])
@@ -103,8 +110,35 @@ class cheb_VAE(torch.nn.Module):
         self.downsample_matrices = downsample_matrices
         self.upsample_matrices = upsample_matrices
         self.adjacency_matrices = adjacency_matrices
-        self.A_edge_index, self.A_norm = zip(*[ChebConv_batch.norm(self.adjacency_matrices[i]._indices(),
-                                                                  num_nodes[i]) for i in range(len(num_nodes))])
+        # vertex order of the hierarchy (see reorder.py): the input is permuted
+        # to it by the encoder and the output permuted back by the decoder
+        self.permutation = permutation
+        self.inverse_permutation = None
+        if permutation is not None:
+            self.inverse_permutation = torch.empty_like(permutation)
+            self.inverse_permutation[permutation] = torch.arange(len(permutation), device=permutation.device)
+        if topologies is None:
+            self.A_edge_index, self.A_norm = zip(*[ChebConv_batch.norm(self.adjacency_matrices[i]._indices(),
+                                                                      num_nodes[i]) for i in range(len(num_nodes))])
+        else:
+            # normalized Laplacians shared with the other users of each level
+            self.A_edge_index, self.A_norm = zip(*[topologies[i].to('cheb_norm', self.adjacency_matrices[i].device)
+                                                   for i in range(len(num_nodes))])
+
+        # the Laplacians and the downsampling/upsampling matrices are used as
+        # given (scatter kernel) or converted once to CSR (spmm) or dense
+        # operators, either for all the levels (conv_kernel) or per level
+        # (kernels, chosen by get_model with kernel_autotune for conv_kernel = auto)
+        if kernels is None: kernels = uniform_kernels(config.get('conv_kernel', 'scatter'), len(num_nodes))
+        self.kernels = kernels
+        self.laplacians = [laplacian_operator(kernels['laplacian'][i], self.A_edge_index[i], self.A_norm[i], num_nodes[i]) for i in range(len(num_nodes))]
+        # the last decoder convolution uses the edges of the coarsest level on the full
+        # resolution mesh, with the vertex indices of the coarsest level taken in the original order
+        self.last_edge_index = self.A_edge_index[-1]
+        if permutation is not None: self.last_edge_index = self.inverse_permutation[self.last_edge_index]
+        self.last_laplacian = laplacian_operator(kernels['last_laplacian'], self.last_edge_index, self.A_norm[-1], num_nodes[0])
+        self.down = [pool_operator(kernels['down'][i], d) for i, d in enumerate(self.downsample_matrices)]
+        self.up = [pool_operator(kernels['up'][i], u) for i, u in enumerate(self.upsample_matrices)]
 
         # convolution layer
         self.cheb = torch.nn.ModuleList([ChebConv_batch(self.filters[i], self.filters[i+1], self.K[i])
@@ -121,6 +155,15 @@ class cheb_VAE(torch.nn.Module):
 
 
         self.cheb_dec[-1].bias = None  # No bias for last convolution layer
+        for conv in list(self.cheb) + list(self.cheb_dec):
+            conv.fused = config.get('fused_chebyshev', False)
+            conv.recompute = config.get('recompute_chebyshev', False)
+
+        # with node_major = True, the convolution and pooling stack works on
+        # (N, B, F) tensors, the layout is only changed before enc_lin and after dec_lin_2
+        self.node_major = config.get('node_major', False)
+        # compiled encoder and decoder, see compile_static
+        self.static = None
 
         self.pool = SurfacePool()
 
@@ -171,6 +214,12 @@ class cheb_VAE(torch.nn.Module):
         # elif self.type == 'non_shared_sigma_VAE':
         #     self.dec_sigma = torch.nn.Linear(num_features*self.adjacency_matrices[0].shape[0], num_features*self.adjacency_matrices[0].shape[0] )
 
+    def compile_static(self, backend = 'compile'):
+        """Replaces the encoder and decoder by their static topology version,
+        compiled with torch.compile (or TorchScript, see models/static_VAE.py)."""
+        self.static = StaticChebVAE(self, backend)
+        return self
+
     def set_param(self, alpha, beta):
         self.alpha = alpha
         self.beta = beta
@@ -180,10 +229,14 @@ class cheb_VAE(torch.nn.Module):
         #x = data
 
 
-        x, edge_index = data.x, data.edge_index
-
+        if torch.is_tensor(data):
+            # dense (B, N, 3) batch
+            x = data
+            batch_size = x.shape[0]
+        else:
+            x, edge_index = data.x, data.edge_index
+            batch_size = data.num_graphs
        # print(x.shape)
-        batch_size = data.num_graphs
        # batch_size = x.shape[0]
         x = x.reshape(batch_size, -1, self.filters[0])
       #  print(x.shape)
@@ -247,33 +300,41 @@ class cheb_VAE(torch.nn.Module):
 
 
     def encoder(self, x):
+        if self.static is not None: return self.static.encode(x)
+        if self.permutation is not None: x = x[:, self.permutation]
+        if self.node_major: x = x.transpose(0, 1)
         for i in range(self.n_layers):
         #    print(x.shape)
-            x = F.relu(self.cheb[i](x, self.A_edge_index[i], self.A_norm[i]))
-            x = self.pool(x, self.downsample_matrices[i])
+            x = F.relu(self.cheb[i](x, self.A_edge_index[i], self.A_norm[i], operator = self.laplacians[i], node_major = self.node_major))
+            x = self.pool(x, self.down[i], node_major = self.node_major)
             # x = self.dropout(x)
            
             
 
+        if self.node_major: x = x.transpose(0, 1)
         x = x.reshape(x.shape[0], self.enc_lin.in_features)
         x = F.relu(self.enc_lin(x))
         x = self.dropout(x)
         return x
 
     def decoder(self, x):
+        if self.static is not None: return self.static.decode(x)
 
         x = F.relu(self.dec_lin(x))
         x = self.dropout(x)
         x = F.relu(self.dec_lin_2(x))
         x = self.dropout(x)
         x = x.reshape(x.shape[0], -1, self.filters[-1])
+        if self.node_major: x = x.transpose(0, 1)
         for i in range(self.n_layers):
             # x = self.AdaIN[i](x, style)
-            x = self.pool(x, self.upsample_matrices[-i-1])
-            x = F.relu(self.cheb_dec[i](x, self.A_edge_index[self.n_layers-i-1], self.A_norm[self.n_layers-i-1]))
+            x = self.pool(x, self.up[-i-1], node_major = self.node_major)
+            x = F.relu(self.cheb_dec[i](x, self.A_edge_index[self.n_layers-i-1], self.A_norm[self.n_layers-i-1], operator = self.laplacians[self.n_layers-i-1], node_major = self.node_major))
             # x = self.dropout(x)
         # x = self.AdaIN[-1](x, style)
-        recon_x = self.cheb_dec[-1](x, self.A_edge_index[-1], self.A_norm[-1])
+        recon_x = self.cheb_dec[-1](x, self.last_edge_index, self.A_norm[-1], operator = self.last_laplacian, node_major = self.node_major)
+        if self.node_major: recon_x = recon_x.transpose(0, 1)
+        if self.permutation is not None: recon_x = recon_x[:, self.inverse_permutation]
 
       
  
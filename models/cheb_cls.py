@@ -16,6 +16,7 @@ import math
 from torch_geometric.utils import remove_self_loops, add_self_loops, degree
 #from nn.pool import SurfacePool
 from torch_geometric.nn.conv.cheb_conv import ChebConv
+from nn.conv import ChebConv_batch
 from torch_scatter import scatter_add
 
 
@@ -29,6 +30,28 @@ def Pool(x, trans, dim=1):
 
 
 
+class StaticChebConv(ChebConv):
+    """PyG ChebConv taking the scaled Laplacian of its graph, precomputed once
+    per level (see MeshTopology.cheb_norm), instead of normalizing
+    edge_index again at every call."""
+    def forward(self, x, edge_index, norm):
+        Tx_0 = x
+        out = self.lins[0](Tx_0)
+
+        if len(self.lins) > 1:
+            Tx_1 = self.propagate(edge_index, x=x, norm=norm)
+            out = out + self.lins[1](Tx_1)
+
+        for lin in self.lins[2:]:
+            Tx_2 = 2. * self.propagate(edge_index, x=Tx_1, norm=norm) - Tx_0
+            out = out + lin(Tx_2)
+            Tx_0, Tx_1 = Tx_1, Tx_2
+
+        if self.bias is not None:
+            out = out + self.bias
+
+        return out
+
 class graph_norm(torch.nn.Module):
     def __init__(self, num):
         super(graph_norm, self).__init__()
@@ -54,7 +77,7 @@ class graph_norm(torch.nn.Module):
 
 class cheb_GCN(torch.nn.Module):
 
-    def __init__(self, num_feature, config, downsample_matrices, upsample_matrices, adjacency_matrices, num_nodes):
+    def __init__(self, num_feature, config, downsample_matrices, upsample_matrices, adjacency_matrices, num_nodes, topologies = None, permutation = None):
         super(cheb_GCN, self).__init__()
         self.n_layers = config['n_layers']
         self.filters = config['num_conv_filters'].copy()
@@ -64,16 +87,22 @@ class cheb_GCN(torch.nn.Module):
         self.downsample_matrices = downsample_matrices
         self.upsample_matrices = upsample_matrices
         self.adjacency_matrices = adjacency_matrices
+        # vertex order of the hierarchy (see reorder.py), the input is permuted to it
+        self.permutation = permutation
 
 #edge_index, edge_weight = remove_self_loops(edge_index, edge_weight)
 
-        self.A_edge_index=[]
-        for i in range(len(num_nodes)):
-            index, _ = remove_self_loops(self.adjacency_matrices[i]._indices()) 
-            self.A_edge_index.append(index)
+        # scaled Laplacian of each level, computed once: with the sym normalization
+        # and lambda_max = 2, the one of PyG ChebConv is -D^-1/2 A D^-1/2
+        if topologies is None:
+            self.A_edge_index, self.A_norm = zip(*[ChebConv_batch.norm(self.adjacency_matrices[i]._indices(), num_nodes[i])
+                                                   for i in range(len(num_nodes))])
+        else:
+            self.A_edge_index, self.A_norm = zip(*[topologies[i].to('cheb_norm', self.adjacency_matrices[i].device)
+                                                   for i in range(len(num_nodes))])
 
 
-        self.cheb = torch.nn.ModuleList([ChebConv(self.filters[i], self.filters[i+1], self.K[i])
+        self.cheb = torch.nn.ModuleList([StaticChebConv(self.filters[i], self.filters[i+1], self.K[i])
                                          for i in range(len(self.filters)-2)])
 
         # self.enc_batch_norm = torch.nn.ModuleList([graph_norm(self.filters[i+1]) for i in range(len(self.filters)-2)])
@@ -89,10 +118,11 @@ class cheb_GCN(torch.nn.Module):
       #  x, edge_index, batch = data.x, data.edge_index, data.batch
        # batch_size = data.num_graphs
         x = x.reshape(batch_size, -1, self.filters[0])
+        if self.permutation is not None: x = x[:, self.permutation]
         # print(x.shape)
         for i in range(self.n_layers): 
           #  print(self.A_norm[i].shape)
-            x = self.cheb[i](x, self.A_edge_index[i])
+            x = self.cheb[i](x, self.A_edge_index[i], self.A_norm[i])
             # x = self.enc_batch_norm[i](x)
             x = F.relu(x)
             
@@ -0,0 +1,116 @@
+"""
+Static topology version of the cheb_VAE encoder and decoder, for TorchScript
+and torch.compile.
+
+The message passing layers of nn/conv.py collect their arguments with
+inspect at every call, which neither torch.jit.script nor torch.compile can
+trace through. Here, the Laplacians and the downsampling/upsampling
+matrices are fixed index and weight tensors, and the whole encoder and
+decoder are plain tensor functions (index_select / index_add), compiled
+once. The parameters are the ones of the cheb_VAE, read at each call, so
+that training and checkpoint loading work unchanged.
+"""
+import torch
+import torch.nn.functional as F
+from typing import List, Optional
+
+def propagate(x, src, dst, weight, num_nodes: int):
+    """out[:, dst] += weight * x[:, src] for a (B, N, F) batch."""
+    messages = x.index_select(1, src) * weight.view(1, -1, 1)
+    out = torch.zeros(x.size(0), num_nodes, x.size(2), dtype=x.dtype, device=x.device)
+    return out.index_add(1, dst, messages)
+
+def cheb_conv(x, src, dst, norm, weight, bias: Optional[torch.Tensor]):
+    """Same as ChebConv_batch.forward."""
+    num_nodes = x.size(1)
+    Tx_0 = x
+    out = torch.matmul(Tx_0, weight[0])
+    if weight.size(0) > 1:
+        Tx_1 = propagate(x, src, dst, norm, num_nodes)
+        out = out + torch.matmul(Tx_1, weight[1])
+        for k in range(2, weight.size(0)):
+            Tx_2 = 2 * propagate(Tx_1, src, dst, norm, num_nodes) - Tx_0
+            out = out + torch.matmul(Tx_2, weight[k])
+            Tx_0, Tx_1 = Tx_1, Tx_2
+    if bias is not None:
+        out = out + bias
+    return out
+
+def encoder(x, permutation: Optional[torch.Tensor], weights: List[torch.Tensor], biases: List[torch.Tensor],
+            lap_src: List[torch.Tensor], lap_dst: List[torch.Tensor], lap_norm: List[torch.Tensor],
+            down_rows: List[torch.Tensor], down_cols: List[torch.Tensor], down_values: List[torch.Tensor], down_sizes: List[int],
+            lin_weight, lin_bias, dropout: float, training: bool):
+    """Same as cheb_VAE.encoder."""
+    if permutation is not None: x = x.index_select(1, permutation)
+    for i in range(len(weights)):
+        x = F.relu(cheb_conv(x, lap_src[i], lap_dst[i], lap_norm[i], weights[i], biases[i]))
+        x = propagate(x, down_cols[i], down_rows[i], down_values[i], down_sizes[i])
+    x = x.reshape(x.size(0), lin_weight.size(1))
+    x = F.relu(F.linear(x, lin_weight, lin_bias))
+    return F.dropout(x, dropout, training)
+
+def decoder(x, inverse_permutation: Optional[torch.Tensor], weights: List[torch.Tensor], biases: List[torch.Tensor],
+            last_weight, lap_src: List[torch.Tensor], lap_dst: List[torch.Tensor], lap_norm: List[torch.Tensor],
+            last_src, last_dst, last_norm,
+            up_rows: List[torch.Tensor], up_cols: List[torch.Tensor], up_values: List[torch.Tensor], up_sizes: List[int],
+            lin_weight, lin_bias, lin_2_weight, lin_2_bias, num_filters: int, dropout: float, training: bool):
+    """Same as cheb_VAE.decoder. The lists of the Laplacians and of the
+    upsampling matrices are given in the order in which they are used."""
+    x = F.dropout(F.relu(F.linear(x, lin_weight, lin_bias)), dropout, training)
+    x = F.dropout(F.relu(F.linear(x, lin_2_weight, lin_2_bias)), dropout, training)
+    x = x.reshape(x.size(0), -1, num_filters)
+    for i in range(len(weights)):
+        x = propagate(x, up_cols[i], up_rows[i], up_values[i], up_sizes[i])
+        x = F.relu(cheb_conv(x, lap_src[i], lap_dst[i], lap_norm[i], weights[i], biases[i]))
+    recon_x = cheb_conv(x, last_src, last_dst, last_norm, last_weight, None)
+    if inverse_permutation is not None: recon_x = recon_x.index_select(1, inverse_permutation)
+    return recon_x
+
+def compile_function(function, backend):
+    """torch.compile, or torch.jit.script (for torch < 2.0 or backend = script).
+    Shapes are static: each batch size gets its own compiled graph."""
+    if backend == 'script' or not hasattr(torch, 'compile'):
+        return torch.jit.script(function)
+    return torch.compile(function, dynamic=False)
+
+def matrix_tensors(matrix):
+    """rows, cols and values of a torch COO matrix."""
+    matrix = matrix.coalesce()
+    return matrix.indices()[0], matrix.indices()[1], matrix.values()
+
+class StaticChebVAE(object):
+    """Compiled encoder and decoder of a cheb_VAE (see cheb_VAE.compile_static)."""
+    def __init__(self, net, backend='compile'):
+        self.net = net
+        n = net.n_layers
+        self.lap_src = [e[0] for e in net.A_edge_index]
+        self.lap_dst = [e[1] for e in net.A_edge_index]
+        self.lap_norm = list(net.A_norm)
+        down = [matrix_tensors(d) for d in net.downsample_matrices]
+        up = [matrix_tensors(net.upsample_matrices[-i-1]) for i in range(n)]
+        self.down_rows, self.down_cols, self.down_values = [list(t) for t in zip(*down)]
+        self.up_rows, self.up_cols, self.up_values = [list(t) for t in zip(*up)]
+        self.down_sizes = [d.size(0) for d in net.downsample_matrices]
+        self.up_sizes = [net.upsample_matrices[-i-1].size(0) for i in range(n)]
+        # the decoder uses the Laplacians from the coarsest level to the finest
+        self.dec_lap = [n - i - 1 for i in range(n)]
+        self.encoder = compile_function(encoder, backend)
+        self.decoder = compile_function(decoder, backend)
+
+    def encode(self, x):
+        net = self.net
+        return self.encoder(x, net.permutation, [c.weight for c in net.cheb], [c.bias for c in net.cheb],
+                            self.lap_src, self.lap_dst, self.lap_norm,
+                            self.down_rows, self.down_cols, self.down_values, self.down_sizes,
+                            net.enc_lin.weight, net.enc_lin.bias, net.dropout.p, net.training)
+
+    def decode(self, x):
+        net = self.net
+        n = net.n_layers
+        return self.decoder(x, net.inverse_permutation, [c.weight for c in net.cheb_dec[:n]], [c.bias for c in net.cheb_dec[:n]],
+                            net.cheb_dec[-1].weight,
+                            [self.lap_src[i] for i in self.dec_lap], [self.lap_dst[i] for i in self.dec_lap], [self.lap_norm[i] for i in self.dec_lap],
+                            net.last_edge_index[0], net.last_edge_index[1], net.A_norm[-1],
+                            self.up_rows, self.up_cols, self.up_values, self.up_sizes,
+                            net.dec_lin.weight, net.dec_lin.bias, net.dec_lin_2.weight, net.dec_lin_2.bias,
+                            net.filters[-1], net.dropout.p, net.training)
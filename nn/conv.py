@@ -14,7 +14,7 @@ import torch.nn.functional as F
 from torch_scatter import scatter_add
 #from torch_geometric.nn.conv import MessagePassing
 from torch_geometric.nn.conv.cheb_conv import ChebConv
-from torch_geometric.utils import remove_self_loops, add_self_loops, degree
+from torch_geometric.utils import remove_self_loops, add_self_loops, degree, softmax
 from torch_geometric.nn import dense_diff_pool
 from torch_geometric.nn import global_sort_pool
 
@@ -41,6 +41,7 @@ from torch_geometric.utils import remove_self_loops, add_self_loops
 from torch_geometric.utils import get_laplacian
 
 import math
+from math import sqrt
 import torch
 from torch_scatter import scatter_add
 
@@ -529,9 +530,72 @@ class ChebConv(MessagePassing):
 
 
 
+def chebyshev_basis(x, laplacian, K):
+    """Yields T_k(L) x for k = 0 ... K-1, keeping only the last two terms."""
+    Tx_0 = x
+    yield Tx_0
+    if K > 1:
+        Tx_1 = laplacian(Tx_0)
+        yield Tx_1
+    for k in range(2, K):
+        Tx_2 = 2 * laplacian(Tx_1) - Tx_0
+        yield Tx_2
+        Tx_0, Tx_1 = Tx_1, Tx_2
+
+class ChebyshevRecompute(torch.autograd.Function):
+    """Chebyshev convolution sum_k T_k(L) x W_k + b of a node-major (N, B, F)
+    batch, which only saves x and the weights for the backward pass.
+    The basis T_k(L) x is recomputed to get the weight gradients, and as the
+    scaled Laplacian L is symmetric, the input gradient
+    sum_k T_k(L) (g W_k^T) is evaluated with Clenshaw's recurrence."""
+    @staticmethod
+    def forward(ctx, x, weight, bias, laplacian):
+        ctx.laplacian = laplacian
+        ctx.has_bias = bias is not None
+        ctx.save_for_backward(x, weight)
+        out = None
+        for k, Tx in enumerate(chebyshev_basis(x, laplacian, weight.size(0))):
+            term = torch.matmul(Tx, weight[k])
+            out = term if out is None else out + term
+        if bias is not None:
+            out = out + bias
+        return out
+
+    @staticmethod
+    def backward(ctx, grad):
+        x, weight = ctx.saved_tensors
+        laplacian = ctx.laplacian
+        K, F_in, F_out = weight.shape
+        grad = grad.contiguous()
+        grad_x = grad_weight = grad_bias = None
+
+        if ctx.needs_input_grad[1]:
+            g = grad.reshape(-1, F_out)
+            grad_weight = torch.stack([torch.matmul(Tx.reshape(-1, F_in).t(), g)
+                                       for Tx in chebyshev_basis(x, laplacian, K)])
+
+        if ctx.has_bias and ctx.needs_input_grad[2]:
+            grad_bias = grad.reshape(-1, F_out).sum(0)
+
+        if ctx.needs_input_grad[0]:
+            # b_k = g W_k^T + 2 L b_k+1 - b_k+2, grad_x = g W_0^T + L b_1 - b_2
+            b_1 = b_2 = None
+            for k in range(K - 1, 0, -1):
+                b = torch.matmul(grad, weight[k].t())
+                if b_1 is not None: b = b + 2 * laplacian(b_1)
+                if b_2 is not None: b = b - b_2
+                b_1, b_2 = b, b_1
+            grad_x = torch.matmul(grad, weight[0].t())
+            if b_1 is not None: grad_x = grad_x + laplacian(b_1)
+            if b_2 is not None: grad_x = grad_x - b_2
+
+        return grad_x, grad_weight, grad_bias, None
+
 class ChebConv_batch(ChebConv):
-    def __init__(self, in_channels, out_channels, K, normalization=None, bias=True):
+    def __init__(self, in_channels, out_channels, K, normalization=None, bias=True, fused=False, recompute=False):
         super(ChebConv_batch, self).__init__(in_channels, out_channels, K, normalization, bias)
+        self.fused = fused
+        self.recompute = recompute
 
     def reset_parameters(self):
         normal(self.weight, 0, 0.1)
@@ -554,7 +618,11 @@ class ChebConv_batch(ChebConv):
 
         return edge_index, -deg_inv_sqrt[row] * edge_weight * deg_inv_sqrt[col]
 
-    def forward(self, x, edge_index, norm, edge_weight=None):
+    def forward(self, x, edge_index, norm, edge_weight=None, operator=None, node_major=False):
+        """x is a (B, N, F) batch, or a (N, B, F) batch with node_major = True."""
+        if node_major: return self.forward_node_major(x, edge_index, norm, operator)
+        if self.fused or self.recompute or operator is not None:
+            return self.forward_node_major(x.transpose(0, 1), edge_index, norm, operator).transpose(0, 1)
         Tx_0 = x
         out = torch.matmul(Tx_0, self.weight[0])
         x = x.transpose(0,1)
@@ -576,6 +644,55 @@ class ChebConv_batch(ChebConv):
 
         return out
 
+    def forward_node_major(self, x, edge_index, norm, operator=None):
+        """Same as forward, on a node-major (N, B, F) batch, returns (N, B, F_out).
+        With a nn.sparse.SparseOperator, the recursion runs on the (N, B*F)
+        layout, one SpMM per Chebyshev order.
+        With fused = True, the Chebyshev basis is gathered into one (N, B, K*F)
+        tensor which is multiplied once by the weights reshaped to
+        (K*F, F_out), instead of K separate matmuls. The basis is built by a
+        single concatenation: writing each order into a preallocated buffer
+        makes the backward pass clone the whole buffer once per order.
+        With recompute = True, the basis is not kept for the backward pass
+        (see ChebyshevRecompute)."""
+        N, B, F = x.shape
+        K = self.weight.size(0)
+        if self.recompute:
+            if operator is not None:
+                laplacian = lambda t: (operator.to(t.dtype).matrix @ t.reshape(N, -1)).view(t.shape)
+            else:
+                laplacian = lambda t: self.propagate(edge_index, x=t, norm=norm)
+            return ChebyshevRecompute.apply(x, self.weight, self.bias, laplacian)
+
+        Tx_0 = x
+        if operator is not None:
+            Tx_0 = x.reshape(N, B * F)
+            propagate = operator.mm
+        else:
+            propagate = lambda t: self.propagate(edge_index, x=t, norm=norm)
+
+        basis = [x]
+        if K > 1:
+            Tx_1 = propagate(Tx_0)
+            basis.append(Tx_1.view(N, B, F))
+
+        for k in range(2, K):
+            Tx_2 = 2 * propagate(Tx_1) - Tx_0
+            basis.append(Tx_2.view(N, B, F))
+            Tx_0, Tx_1 = Tx_1, Tx_2
+
+        if self.fused:
+            out = torch.matmul(torch.cat(basis, dim=-1), self.weight.view(K * F, -1))
+        else:
+            out = torch.matmul(basis[0], self.weight[0])
+            for k in range(1, K):
+                out = out + torch.matmul(basis[k], self.weight[k])
+
+        if self.bias is not None:
+            out = out + self.bias
+
+        return out
+
     def message(self, x_j, norm):
 
         return norm.view(-1, 1, 1) * x_j
@@ -591,20 +708,24 @@ class Spatial_conv(MessagePassing):
         super(Spatial_conv, self).__init__(aggr='add')  # "Add" aggregation (Step 5).
         self.lin = torch.nn.Linear(in_channels, out_channels)
 
-    def forward(self, x, edge_index):
-        x = x.transpose(0,1)
+    @staticmethod
+    def norm(edge_index, num_nodes, dtype=None):
         # Add self-loops to the adjacency matrix.
-        edge_index, _ = add_self_loops(edge_index, edge_weight = None, num_nodes=x.size(0)) #A~ = A+I
-        # Linearly transform node feature matrix.
-        x = self.lin(x)
-        
-        
+        edge_index, _ = add_self_loops(edge_index, edge_weight = None, num_nodes=num_nodes) #A~ = A+I
 
         # Compute normalization.
         row, col = edge_index
-        deg = degree(col, x.size(0), dtype=x.dtype)
+        deg = degree(col, num_nodes, dtype=dtype)
         deg_inv_sqrt = deg.pow(-0.5)
-        norm = deg_inv_sqrt[row] * deg_inv_sqrt[col]  # sqrt(D)*sqrt(D)
+        return edge_index, deg_inv_sqrt[row] * deg_inv_sqrt[col]  # sqrt(D)*sqrt(D)
+
+    def forward(self, x, edge_index, norm=None):
+        """edge_index and norm can be precomputed once per graph with
+        Spatial_conv.norm, otherwise they are computed at each call."""
+        x = x.transpose(0,1)
+        if norm is None: edge_index, norm = self.norm(edge_index, x.size(0), x.dtype)
+        # Linearly transform node feature matrix.
+        x = self.lin(x)
 
         # Start propagating messages.
         out = self.propagate(edge_index, x=x, norm=norm)
@@ -684,6 +805,42 @@ class graph_attention(nn.Module):
         torch.nn.init.normal_(self.linear.weight, 0, 0.1)
 
 
+class sparse_graph_attention(graph_attention):
+    """
+    Same as graph_attention (same parameters), with the attention scores
+    computed on the edges only and normalized by a softmax over the incoming
+    edges of each vertex: O(E) memory and compute instead of O(N^2).
+    edge_index is a (2, E) tensor, each edge sending edge_index[0] to
+    edge_index[1]; the dense mask A of graph_attention corresponds to
+    A.nonzero().t().flip(0). Vertices without incoming edges get zero
+    features, instead of a uniform average over all the vertices.
+    """
+    def forward(self, x, edge_index):
+        out = []
+        # x: [B,N,F] => x: [B, N, F']
+        dk = sqrt(x.shape[-1])
+        src, dst = edge_index
+        num_nodes = x.shape[1]
+        for i in range(self.num_heads):
+            features = self.value[i](x)  # features => [B,N,F']
+            query = self.att_q[i](x)   # => [B, N, F']
+            key = self.att_k[i](x)   # => [B, N, F']
+
+            score = (query[:, dst] * key[:, src]).sum(-1) / dk  # [B, E]
+            score = self.leakyReLU(score)
+            prop = softmax(score, dst, num_nodes=num_nodes, dim=1)
+
+            drop_feat = self.drop_out(features)  # [B*N*F']
+            features = scatter_add(prop.unsqueeze(-1) * drop_feat[:, src], dst, dim=1, dim_size=num_nodes)  #[B,N,F']
+
+            out.append(features)
+
+        out = torch.mean(torch.stack(out), dim = 0)
+        out = self.leakyReLU(out)
+
+        return out
+
+
 
 
 
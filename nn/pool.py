@@ -3,6 +3,7 @@ from torch_scatter import scatter_add
 #from torch_geometric.nn.conv import MessagePassing
 #from torch_geometric.nn.conv.cheb_conv import ChebConv
 from .conv import MessagePassing
+from .sparse import SparseOperator
 from torch_geometric.utils import remove_self_loops, add_self_loops, degree
 from torch_geometric.nn import dense_diff_pool
 # from torch_geometric.nn import global_sort_pool
@@ -14,10 +15,15 @@ class SurfacePool(MessagePassing):
     def __init__(self):
         super(SurfacePool, self).__init__(flow='target_to_source')
 
-    def forward(self, x, pool_mat,  dtype=None):
-        x = x.transpose(0,1)
-        out = self.propagate(edge_index=pool_mat._indices(), x=x, norm=pool_mat._values(), size=pool_mat.size())
-        return out.transpose(0,1)
+    def forward(self, x, pool_mat,  dtype=None, node_major=False):
+        """x is a (B, N, F) batch, or a (N, B, F) batch with node_major = True."""
+        if not node_major: x = x.transpose(0,1)
+        if isinstance(pool_mat, SparseOperator):
+            N, B, F = x.shape
+            out = pool_mat.mm(x.reshape(N, B * F)).view(-1, B, F)
+        else:
+            out = self.propagate(edge_index=pool_mat._indices(), x=x, norm=pool_mat._values(), size=pool_mat.size())
+        return out if node_major else out.transpose(0,1)
 
     def message(self, x_j, norm):
         return norm.view(-1, 1, 1) * x_j
@@ -0,0 +1,87 @@
+"""
+Sparse operators (graph Laplacians, downsampling and upsampling matrices)
+applied as sparse-dense matrix products.
+
+Each operator is converted once to CSR, together with its transpose which is
+used in the backward pass. Features are processed in the node-major (N, B*F)
+layout, so that a whole batch goes through a single SpMM.
+DenseOperator stores the same matrices as dense tensors, which is faster for
+the small levels of the mesh hierarchy.
+"""
+import torch
+
+class SparseOperator(object):
+    """Constant sparse matrix of size (N_out, N_in), in CSR form, with the
+    dtype of values. Inputs of another dtype use a copy of the operator
+    converted to their dtype."""
+    def __init__(self, indices, values, size):
+        indices = indices.to(torch.int64)
+        self.indices, self.values = indices, values
+        self.size = tuple(size)
+        self.dtypes = {values.dtype: self}
+        self.matrix = torch.sparse_coo_tensor(indices, values, self.size).coalesce().to_sparse_csr()
+        self.transpose = torch.sparse_coo_tensor(indices.flip(0), values, self.size[::-1]).coalesce().to_sparse_csr()
+
+    @classmethod
+    def from_coo(cls, matrix):
+        """From a torch COO tensor."""
+        matrix = matrix.coalesce()
+        return cls(matrix.indices(), matrix.values(), matrix.size())
+
+    @classmethod
+    def from_messages(cls, edge_index, weight, num_nodes):
+        """Operator summing weight * x[edge_index[0]] into edge_index[1], as
+        MessagePassing.propagate with the source_to_target flow."""
+        return cls(edge_index.flip(0), weight, (num_nodes, num_nodes))
+
+    def to(self, dtype):
+        """The operator with values of the given dtype, converted once."""
+        if dtype not in self.dtypes:
+            operator = type(self)(self.indices, self.values.to(dtype), self.size)
+            operator.dtypes = self.dtypes
+            self.dtypes[dtype] = operator
+        return self.dtypes[dtype]
+
+    def mm(self, x):
+        """Product with a (N_in, C) dense tensor, differentiable in x."""
+        return SpMM.apply(self.to(x.dtype), x)
+
+    def __call__(self, x):
+        """Product with a (B, N_in, F) batch, returns (B, N_out, F)."""
+        B, N, F = x.shape
+        x = x.transpose(0, 1).reshape(N, B * F)
+        return self.mm(x).view(-1, B, F).transpose(0, 1)
+
+class DenseOperator(SparseOperator):
+    """Same as SparseOperator, with dense matrices."""
+    def __init__(self, indices, values, size):
+        indices = indices.to(torch.int64)
+        self.indices, self.values = indices, values
+        self.size = tuple(size)
+        self.dtypes = {values.dtype: self}
+        self.matrix = torch.sparse_coo_tensor(indices, values, self.size).to_dense()
+        self.transpose = self.matrix.t().contiguous()
+
+OPERATORS = {'spmm': SparseOperator, 'dense': DenseOperator}
+
+def laplacian_operator(kernel, edge_index, weight, num_nodes):
+    """Scaled Laplacian of a level for ChebConv_batch, None with the scatter
+    kernel (message passing on edge_index)."""
+    if kernel == 'scatter': return None
+    return OPERATORS[kernel].from_messages(edge_index, weight, num_nodes)
+
+def pool_operator(kernel, matrix):
+    """Downsampling or upsampling matrix for SurfacePool, the COO tensor
+    itself with the scatter kernel."""
+    if kernel == 'scatter': return matrix
+    return OPERATORS[kernel].from_coo(matrix)
+
+class SpMM(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, operator, x):
+        ctx.operator = operator
+        return operator.matrix @ x
+
+    @staticmethod
+    def backward(ctx, grad):
+        return None, ctx.operator.transpose @ grad.contiguous()
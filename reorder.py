@@ -0,0 +1,51 @@
+"""
+Vertex reordering of the mesh hierarchy, for memory locality.
+
+The vertices of the template and of the decimated levels come in an
+arbitrary order, so that neighbouring vertices are far apart in memory and
+the gathers and scatters of the convolution and pooling layers jump around.
+With vertex_order = rcm, the vertices of each level are sorted in reverse
+Cuthill-McKee order, which keeps the neighbours of a vertex close to it, and
+the A, D and U matrices are permuted accordingly.
+
+The coarsest level keeps its order, so that the linear layers and the
+checkpoints do not depend on the reordering, and the models permute their
+input and output at level 0: data and results stay in the original order.
+"""
+import numpy as np
+from psbody.mesh import Mesh
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+import scipy.sparse as sp
+
+ORDERS = ['original', 'rcm']
+
+def rcm_permutation(adjacency):
+    """permutation[i] is the original index of the vertex placed at i."""
+    return reverse_cuthill_mckee(sp.csr_matrix(adjacency), symmetric_mode=True).astype(np.int64)
+
+def inverse_permutation(permutation):
+    inverse = np.empty_like(permutation)
+    inverse[permutation] = np.arange(len(permutation))
+    return inverse
+
+def permute_mesh(mesh, permutation):
+    return Mesh(v=mesh.v[permutation], f=inverse_permutation(permutation)[mesh.f])
+
+def permute_matrix(matrix, rows, cols):
+    return sp.csr_matrix(matrix)[rows][:, cols].tocoo()
+
+def reorder_hierarchy(M, A, D, U, order='rcm'):
+    """Returns M, A, D, U with the vertices of each level but the last one
+    reordered, and the permutation of each level."""
+    assert order in ORDERS, 'Invalid vertex order'
+    permutations = [np.arange(len(mesh.v), dtype=np.int64) for mesh in M]
+    if order == 'original': return M, A, D, U, permutations
+    for level in range(len(M) - 1):
+        permutations[level] = rcm_permutation(A[level])
+
+    p = permutations
+    M = [permute_mesh(mesh, p[i]) for i, mesh in enumerate(M)]
+    A = [permute_matrix(a, p[i], p[i]) for i, a in enumerate(A)]
+    D = [permute_matrix(d, p[i + 1], p[i]) for i, d in enumerate(D)]
+    U = [permute_matrix(u, p[i], p[i + 1]) for i, u in enumerate(U)]
+    return M, A, D, U, permutations
@@ -0,0 +1,75 @@
+"""
+SparseOperator and DenseOperator (nn/sparse.py) against the dense matrix
+product, forward and backward.
+"""
+import pytest
+import torch
+from nn.sparse import DenseOperator, SparseOperator
+
+OPERATORS = [SparseOperator, DenseOperator]
+
+def random_laplacian(num_nodes=12, dtype=torch.float64):
+    """edge_index and weights of a random symmetric graph with self loops,
+    and the dense matrix of the messages (out[dst] += weight * x[src])."""
+    generator = torch.Generator().manual_seed(0)
+    adjacency = torch.rand(num_nodes, num_nodes, generator=generator) < 0.3
+    adjacency = adjacency | adjacency.t() | torch.eye(num_nodes, dtype=torch.bool)
+    edge_index = adjacency.nonzero().t()
+    weight = torch.randn(edge_index.size(1), generator=generator, dtype=dtype)
+    dense = torch.zeros(num_nodes, num_nodes, dtype=dtype)
+    dense[edge_index[1], edge_index[0]] = weight
+    return edge_index, weight, dense
+
+@pytest.mark.parametrize('Operator', OPERATORS)
+@pytest.mark.parametrize('dtype', [torch.float32, torch.float64])
+def test_forward(Operator, dtype):
+    edge_index, weight, dense = random_laplacian(dtype=dtype)
+    operator = Operator.from_messages(edge_index, weight, dense.size(0))
+    x = torch.randn(dense.size(0), 5, dtype=dtype)
+    out = operator.mm(x)
+    assert out.dtype == dtype
+    torch.testing.assert_close(out, dense @ x)
+
+@pytest.mark.parametrize('Operator', OPERATORS)
+def test_batch(Operator):
+    edge_index, weight, dense = random_laplacian()
+    operator = Operator.from_messages(edge_index, weight, dense.size(0))
+    x = torch.randn(3, dense.size(0), 4, dtype=torch.float64)
+    torch.testing.assert_close(operator(x), dense @ x)
+
+@pytest.mark.parametrize('Operator', OPERATORS)
+def test_rectangular(Operator):
+    dense = torch.randn(4, 9, dtype=torch.float64) * (torch.rand(4, 9) < 0.5)
+    operator = Operator.from_coo(dense.to_sparse())
+    x = torch.randn(9, 6, dtype=torch.float64, requires_grad=True)
+    grad = torch.randn(4, 6, dtype=torch.float64)
+    operator.mm(x).backward(grad)
+    torch.testing.assert_close(x.grad, dense.t() @ grad)
+
+@pytest.mark.parametrize('Operator', OPERATORS)
+def test_backward(Operator):
+    edge_index, weight, dense = random_laplacian(dtype=torch.float32)
+    operator = Operator.from_messages(edge_index, weight, dense.size(0))
+    x = torch.randn(dense.size(0), 5, requires_grad=True)
+    grad = torch.randn(dense.size(0), 5)
+    operator.mm(x).backward(grad)
+    torch.testing.assert_close(x.grad, dense.t() @ grad)
+
+@pytest.mark.parametrize('Operator', OPERATORS)
+def test_gradcheck(Operator):
+    edge_index, weight, dense = random_laplacian()
+    operator = Operator.from_messages(edge_index, weight, dense.size(0))
+    x = torch.randn(dense.size(0), 3, dtype=torch.float64, requires_grad=True)
+    assert torch.autograd.gradcheck(operator.mm, (x,))
+
+@pytest.mark.parametrize('Operator', OPERATORS)
+def test_input_dtype(Operator):
+    """A float32 operator keeps the precision of float64 inputs."""
+    edge_index, weight, dense = random_laplacian(dtype=torch.float32)
+    operator = Operator.from_messages(edge_index, weight, dense.size(0))
+    x = torch.randn(dense.size(0), 5, dtype=torch.float64, requires_grad=True)
+    out = operator.mm(x)
+    assert out.dtype == torch.float64
+    torch.testing.assert_close(out, dense.double() @ x)
+    assert torch.autograd.gradcheck(operator.mm, (x,))
+    assert operator.to(torch.float64) is operator.to(torch.float64)
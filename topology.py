@@ -0,0 +1,112 @@
+"""
+Mesh topology shared by all the consumers of a mesh level.
+
+The connectivity of a level is built once, in a single COO pass over the
+faces, and every derived structure (edge list, edge_index, scaled
+Laplacian) is computed lazily and memoized. get_topology returns the same
+MeshTopology object for identical faces, so the QSlim decimator, the
+datasets and the convolution layers all share one instance per level. Only
+the MAX_TOPOLOGIES most recently used topologies are kept.
+"""
+from collections import OrderedDict
+from functools import cached_property
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+class MeshTopology(object):
+    def __init__(self, faces, num_vertices):
+        self.faces = np.asarray(faces, dtype=np.int64)
+        self.num_vertices = int(num_vertices)
+        self._device_cache = {}
+
+    @cached_property
+    def connectivity(self):
+        """CSC matrix (of size #verts x #verts) where each nonzero element
+        indicates a neighborhood relation. The value counts the number of
+        half-edges between the two vertices."""
+        rows = np.concatenate((self.faces, np.roll(self.faces, -1, axis=1)), axis=1).ravel()
+        cols = np.concatenate((np.roll(self.faces, -1, axis=1), self.faces), axis=1).ravel()
+        n = self.num_vertices
+        matrix = sp.csc_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+        matrix.sum_duplicates()
+        return matrix
+
+    @cached_property
+    def coo(self):
+        return self.connectivity.tocoo()
+
+    @cached_property
+    def edges(self):
+        """Ex2 array of edges, each edge is included only once."""
+        coo = self.coo
+        keep = coo.row < coo.col
+        return np.stack((coo.row[keep], coo.col[keep]), axis=1).astype(np.int64)
+
+    @cached_property
+    def edge_index(self):
+        """(2, 2E) torch.LongTensor with both directions of each edge."""
+        coo = self.coo
+        return torch.from_numpy(np.vstack((coo.row, coo.col)).astype(np.int64))
+
+    @cached_property
+    def cheb_norm(self):
+        """edge_index and weights of the scaled Laplacian used by
+        ChebConv_batch (lambda_max = 2, no self loops). This is also the
+        scaled Laplacian of the PyG ChebConv with the sym normalization,
+        whose self loops (1 from the Laplacian, -1 from the scaling) cancel."""
+        edge_index = self.edge_index
+        row, col = edge_index
+        edge_weight = torch.ones((edge_index.size(1), ), dtype=torch.float32)
+        deg = torch.zeros(self.num_vertices, dtype=torch.float32).index_add_(0, row, edge_weight)
+        deg_inv_sqrt = deg.pow(-0.5)
+        deg_inv_sqrt[deg_inv_sqrt == float('inf')] = 0
+        return edge_index, -deg_inv_sqrt[row] * edge_weight * deg_inv_sqrt[col]
+
+    def to(self, name, device):
+        """Returns the tensor(s) of attribute name on device, memoized."""
+        key = (name, str(device))
+        if key not in self._device_cache:
+            value = getattr(self, name)
+            if torch.is_tensor(value): value = value.to(device)
+            else: value = tuple(v.to(device) for v in value)
+            self._device_cache[key] = value
+        return self._device_cache[key]
+
+# enough for the levels of a few hierarchies and the dataset meshes
+MAX_TOPOLOGIES = 16
+
+_topologies = OrderedDict()
+
+def get_topology(faces, num_vertices):
+    """Returns the shared MeshTopology of a mesh level, through a least
+    recently used cache of MAX_TOPOLOGIES topologies."""
+    faces = np.ascontiguousarray(faces, dtype=np.int64)
+    key = (int(num_vertices), faces.shape, hashlib.sha1(faces.tobytes()).hexdigest())
+    if key in _topologies:
+        _topologies.move_to_end(key)
+        return _topologies[key]
+    _topologies[key] = MeshTopology(faces, num_vertices)
+    if len(_topologies) > MAX_TOPOLOGIES: _topologies.popitem(last=False)
+    return _topologies[key]
+
+def get_mesh_topology(mesh):
+    return get_topology(mesh.f, len(mesh.v))
+
+def get_vert_connectivity(mesh_v, mesh_f):
+    """Returns a sparse matrix (of size #verts x #verts) where each nonzero
+    element indicates a neighborhood relation. For example, if there is a
+    nonzero element in position (15,12), that means vertex 15 is connected
+    by an edge to vertex 12."""
+
+    return get_topology(mesh_f, len(mesh_v)).connectivity.copy()
+
+def open3d_order(faces, num_vertices):
+    """Returns the vertices in order of first occurrence in faces (the order
+    used by open3d) and the new index of each vertex (-1 if unused)."""
+    unique, first = np.unique(np.asarray(faces).ravel(), return_index=True)
+    order = unique[np.argsort(first)]
+    indices = np.full(shape=num_vertices, fill_value=-1)
+    indices[order] = np.arange(len(order))
+    return order, indices
@@ -1,6 +1,7 @@
 
 import numpy as np
 import torch
+from topology import open3d_order
 
 class Normalize(object):
     def __init__(self, mean=None, std=None):
@@ -13,4 +14,17 @@ class Normalize(object):
         self.std = torch.as_tensor(self.std, dtype=data.x.dtype, device=data.x.device)
         data.x = (data.x - self.mean)/self.std
         data.y = (data.y - self.mean)/self.std
-        return data
\ No newline at end of file
+        return data
+
+class Open3DOrder(object):
+    """Reorders the vertices of meshes sharing the faces of a reference mesh
+    the same way open3d does (see topology.open3d_order). The permutation is
+    computed once, so whole (B, N, 3) stacks of vertices can be reordered at once."""
+    def __init__(self, faces, num_vertices):
+        self.order, indices = open3d_order(faces, num_vertices)
+        self.faces = indices[faces].astype(np.asarray(faces).dtype)
+
+    def __call__(self, v):
+        out = v.clone() if torch.is_tensor(v) else np.copy(v)
+        out[..., :len(self.order), :] = v[..., self.order, :]
+        return out
@@ -2,6 +2,7 @@ import numpy as np
 import scipy.sparse as sp
 import torch
 from scipy.linalg import orthogonal_procrustes
+from topology import get_vert_connectivity
 
 def euclidean_distances(gt, pred):
     return np.sqrt(((gt-pred)**2).sum(-1))
@@ -13,26 +14,6 @@ def col(A):
     return A.reshape((-1, 1))
 
 
-def get_vert_connectivity(mesh_v, mesh_f):
-    """Returns a sparse matrix (of size #verts x #verts) where each nonzero
-    element indicates a neighborhood relation. For example, if there is a
-    nonzero element in position (15,12), that means vertex 15 is connected
-    by an edge to vertex 12."""
-
-    vpv = sp.csc_matrix((len(mesh_v),len(mesh_v)))
-
-    # for each column in the faces...
-    for i in range(3):
-        IS = mesh_f[:,i]
-        JS = mesh_f[:,(i+1)%3]
-        data = np.ones(len(IS))
-        ij = np.vstack((row(IS.flatten()), row(JS.flatten())))
-        mtx = sp.csc_matrix((data, ij), shape=vpv.shape)
-        vpv = vpv + mtx + mtx.T
-
-    return vpv
-
-
 def normal(tensor, mean, std):
     if tensor is not None:
         torch.nn.init.normal_(tensor, mean=mean, std=std)
@@ -137,4 +118,99 @@ def procrustes(data1, data2):
     # measure the dissimilarity between the two datasets
     disparity = np.sum(np.square(mtx1 - mtx2))
 
-    return mtx1, mtx2, disparity, [R, norm2/s, mtx2_]
\ No newline at end of file
+    return mtx1, mtx2, disparity, [R, norm2/s, mtx2_]
+
+def procrustes_batch(data1, data2):
+    """Batched version of procrustes: aligns each mesh of data2 (B x N x 3)
+    on data1 (N x 3) with a single vectorized computation of the centroids,
+    norms and SVDs. data2 may be a numpy array or a torch tensor (in which
+    case the computation stays on its device).
+    Returns mtx1 (N x 3), mtx2 (B x N x 3), disparity (B) and [R (B x 3 x 3),
+    s (B), m (B x 3)] with the same values as procrustes applied to each mesh.
+    """
+    if torch.is_tensor(data2):
+        mtx2 = data2.to(torch.float64)
+        mtx1 = torch.as_tensor(data1, dtype=torch.float64, device=mtx2.device)
+        svd, norm = torch.linalg.svd, lambda x: torch.linalg.vector_norm(x, dim=(-2, -1))
+    else:
+        mtx2 = np.asarray(data2, dtype=np.double)
+        mtx1 = np.asarray(data1, dtype=np.double)
+        svd, norm = np.linalg.svd, lambda x: np.linalg.norm(x, axis=(-2, -1))
+
+    if mtx1.ndim != 2 or mtx2.ndim != 3:
+        raise ValueError("Input matrices must be two and three-dimensional")
+    if tuple(mtx1.shape) != tuple(mtx2.shape[1:]):
+        raise ValueError("Input matrices must be of same shape")
+    if mtx1.shape[0] == 0 or mtx1.shape[1] == 0:
+        raise ValueError("Input matrices must be >0 rows and >0 cols")
+
+    # translate all the data to the origin
+    mtx2_ = mtx2.mean(-2)
+    mtx1 = mtx1 - mtx1.mean(-2)
+    mtx2 = mtx2 - mtx2_[:, None, :]
+
+    norm1 = norm(mtx1)
+    norm2 = norm(mtx2)
+
+    if norm1 == 0 or (norm2 == 0).any():
+        raise ValueError("Input matrices must contain >1 unique points")
+
+    # change scaling of data (in rows) such that trace(mtx*mtx') = 1
+    mtx1 = mtx1 / norm1
+    mtx2 = mtx2 / norm2[:, None, None]
+
+    # transform mtx2 to minimize disparity, as scipy.linalg.orthogonal_procrustes
+    u, w, vt = svd(mtx1.T @ mtx2)
+    R = u @ vt
+    s = w.sum(-1)
+    mtx2 = (mtx2 @ R.swapaxes(-1, -2)) * s[:, None, None]
+
+    # measure the dissimilarity between the two datasets
+    disparity = ((mtx1 - mtx2) ** 2).sum((-2, -1))
+
+    return mtx1, mtx2, disparity, [R, norm2/s, mtx2_]
+
+
+def generalized_procrustes(data, reference, tolerance=1e-8, max_iterations=100):
+    """Generalized Procrustes analysis: iteratively aligns all the meshes of
+    data (B x N x 3, numpy array or torch tensor) on their mean shape, starting
+    from reference (N x 3), until the standardized mean moves by less than
+    tolerance. Each iteration is a single procrustes_batch call.
+    Returns the mean shape, the number of iterations and, as procrustes_batch,
+    the aligned meshes, the disparities and [R, s, m], so that the original
+    meshes are (aligned * s) @ R + m.
+    """
+    mean = procrustes_batch(reference, data[:1])[0]
+    for iteration in range(1, max_iterations + 1):
+        _, aligned, disparity, res = procrustes_batch(mean, data)
+        new_mean = aligned.mean(0)
+        new_mean = new_mean - new_mean.mean(0)
+        new_mean = new_mean / (new_mean ** 2).sum() ** 0.5
+        change = ((new_mean - mean) ** 2).sum() ** 0.5
+        if change < tolerance: break
+        mean = new_mean
+    return mean, iteration, aligned, disparity, res
+
+def generalized_procrustes_blocks(blocks, reference, tolerance=1e-8, max_iterations=100):
+    """Out of core version of generalized_procrustes: blocks() returns an
+    iterator over the meshes, as B x N x 3 blocks, and is called once per
+    iteration, so that a single block is in memory at a time.
+    Returns the mean shape, the number of iterations and, as
+    generalized_procrustes, [R, s, m] for all the meshes.
+    """
+    mean = procrustes_batch(reference, next(iter(blocks()))[:1])[0]
+    for iteration in range(1, max_iterations + 1):
+        total, count = 0, 0
+        res = [[], [], []]
+        for data in blocks():
+            _, aligned, _, r = procrustes_batch(mean, data)
+            total = total + aligned.sum(0)
+            count += len(aligned)
+            for l, a in zip(res, r): l.append(a)
+        new_mean = total / count
+        new_mean = new_mean - new_mean.mean(0)
+        new_mean = new_mean / (new_mean ** 2).sum() ** 0.5
+        change = ((new_mean - mean) ** 2).sum() ** 0.5
+        if change < tolerance: break
+        mean = new_mean
+    return mean, iteration, [np.concatenate(l) for l in res]